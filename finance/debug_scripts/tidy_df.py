@@ -1,12 +1,6 @@
 # myfin/debug_scripts/tidy_df.py
 
-def tidy(df):
-    """
-    Drops duplicates and sorts columns
-
-    TODO: make sort by ['date', '_item', 'accX'] (if present)
-    """
-    orig_index = df.index.names
-    out = df.reset_index().drop_duplicates()
-    out = out.sort_values(list(out.columns))
-    return out.set_index(orig_index)
+# tidy() now lives with the code appending to the dbs, with merge_sorted()
+# for adding rows to a db that is already tidy without re-sorting all of it
+from finance.load_new_txs.append_to_dbs import (tidy, is_tidy, ensure_tidy,
+                                                merge_sorted)
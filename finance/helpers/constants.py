@@ -3,6 +3,69 @@
 DB_NAMES = ['tx_db', 'cat_db', 'fuzzy_db', 'unknowns_db']
 
 TX_DB_COLUMNS = ['accX', 'accY', 'net_amt', 'ITEM', '_item',
-                 'id', 'mode', 'source', 'y_amt', 'balance']
+                 'id', 'mode', 'source', 'y_amt', 'balance', 'fingerprint']
 
 
+# project settings - any of these can be overridden in <project>/config.json
+DEFAULT_CONFIG = {
+    # format the dbs are kept in: 'csv', 'parquet', 'feather' or 'sqlite'
+    # (see db_storage.py, and migrate_dbs() to convert the csvs)
+    'storage': 'csv',
+    # only write new tx_db rows after loading, as segments (see
+    # append_tx_db()), merged into tx_db once there are tx_db_compact_after
+    'tx_db_segments': False,
+    'tx_db_compact_after': 20,
+    # keep tx_db in partitions by account and 'year' or 'month' (or None)
+    # - see read_tx_db() in db_storage.py
+    'tx_db_partition_by': None,
+    # keep tx_db.arrow, a read-only copy of tx_db for analysis processes
+    # to memory map, up to date (see open_arrow_export() in db_storage.py)
+    'tx_db_arrow_export': False,
+    # snapshots kept in db_archive: the last archive_keep_last, plus the
+    # last of each of the last archive_keep_days days (see archive_dbs.py)
+    'archive_keep_last': 20,
+    'archive_keep_days': 90,
+    # seconds to wait for another process writing the dbs (None to wait
+    # for as long as it takes) - see project_lock.py
+    'lock_timeout': None,
+    # read statement csvs in chunks of this many rows, each taken through
+    # load_new_txs in turn (None to read each whole)
+    'stream_chunk_size': None,
+    # load all of an account's new csvs as one batch, rather than one by
+    # one (see read_new_txs() in load_new_txs.py)
+    'batch_files': False,
+    # processes load_all_accounts() prepares accounts in (None for one
+    # per cpu)
+    'load_workers': None,
+    # [regex, replacement] pairs applied to all _items (see
+    # canonicalise_items.py) - accounts can add their own in item_rules.json
+    'item_rules': [],
+    # substring / prefix rules for accY applied to all accounts (see
+    # target_rules.py) - accounts can add their own in target_rules.json
+    'target_rules': [],
+    # 'fuzzywuzzy', or 'tfidf' for the sparse tfidf engine in tfidf_match.py
+    # (which uses fuzzy_threshold but none of the other fuzzy settings)
+    'match_engine': 'fuzzywuzzy',
+    # fuzzy matching: scorers are run in this order (cheapest first), and
+    # an item is not scored further once it reaches fuzzy_short_circuit
+    'fuzzy_scorers': ['ratio', 'token_set_ratio', 'token_sort_ratio'],
+    'fuzzy_threshold': 55,
+    'fuzzy_short_circuit': 100,
+    # fuzzy match against the account's own cat_db keys first, and only
+    # against all of them for items with no hit there
+    'fuzzy_account_first': False,
+    # only fuzzy match against the cat_db keys sharing most n-grams / words
+    # with each item, using the index in cat_db_index.json
+    'gram_index': False,
+    'gram_index_top_n': 50,
+    'gram_index_min_shared': 1,
+    # number of fuzzy matched items per load to also check with a full scan
+    'gram_index_recall_sample': 20,
+    # keep fuzzy match results between runs, in match_cache.json
+    'match_cache': True,
+    'match_cache_size': 10000,
+    # fuzzy match in this many processes (1 for no pool), but only when
+    # there are at least fuzzy_parallel_min_items distinct items
+    'fuzzy_workers': 1,
+    'fuzzy_parallel_min_items': 200,
+}
@@ -0,0 +1,30 @@
+# myfin/finance/helpers/db_hash.py
+
+from hashlib import sha1
+import pandas as pd
+
+def hash_keys(keys):
+    """
+    Returns a hash of the set of keys (eg a db index), independent of order
+    and repeats
+    """
+
+    joined = "\n".join(sorted(set(str(x) for x in keys)))
+
+    return sha1(joined.encode()).hexdigest()
+
+
+def hash_db(db):
+    """
+    Returns a hash of the contents of db (a df), including its index and
+    row order
+    """
+
+    db = db.reset_index()
+    row_hashes = pd.util.hash_pandas_object(db, index=False)
+
+    out = sha1(",".join(str(x) for x in db.columns).encode())
+    out.update(row_hashes.values.tobytes())
+
+    return out.hexdigest()
+
@@ -0,0 +1,680 @@
+# myfin/finance/helpers/db_storage.py
+
+import sqlite3
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+import numpy as np
+import pandas as pd
+
+from .constants import DB_NAMES, TX_DB_COLUMNS
+from .load_config import load_config
+
+"""
+Reading and writing the dbs in the project dir, in the format set by the
+'storage' entry of the project config:
+
+    'csv'       - <db>.csv, as always
+    'parquet'   - <db>.parquet (needs pyarrow or fastparquet)
+    'feather'   - <db>.feather (needs pyarrow)
+    'sqlite'    - a table for each db in dbs.sqlite, indexed on
+                  (_item, accX), accX and (for tx_db) date, so curation
+                  can update it in place (see update_dbs/sqlite_updates.py)
+
+Columnar files keep the dtypes in SCHEMAS, so nothing is re-inferred or
+re-parsed when loading.  With any format other than csv, fuzzy_db and
+unknowns_db are also written out as csv for editing by hand - and if the
+csv has been saved since the stored db, it is the one read.
+
+New tx_db rows can be added without rewriting it, with append_tx_db(), as
+segment files in tx_db_segments/ that are read back after it, until
+compact_tx_db() (or any full write) merges them in.  Segments can also be
+written while loading, to a staging dir of tx_db_staging/, and only added
+to tx_db at the end (see stage_segment()).
+
+tx_db can also be partitioned by account and year or month, so that
+read_tx_db() only reads the partitions for the dates and accounts asked
+for, and appends only rewrite the partitions they fall in.
+
+Optionally, every write of tx_db also refreshes tx_db.arrow, a read-only
+export that open_arrow_export() memory maps (needs pyarrow).
+"""
+
+STORAGE_FORMATS = ['csv', 'parquet', 'feather', 'sqlite']
+
+SQLITE_FILE_NAME = 'dbs.sqlite'
+
+# rows appended to tx_db since it was last written in full (see
+# append_tx_db()), read back after it by read_db()
+SEGMENTS_DIR_NAME = 'tx_db_segments'
+
+# segments written while loading, before they are added to tx_db - each
+# load stages them in its own dir in this one
+STAGING_DIR_NAME = 'tx_db_staging'
+
+# tx_db can be kept in partitions, <accX>/<period>.<storage>, in this dir
+PARTITIONS_DIR_NAME = 'tx_db_partitions'
+PARTITION_FORMATS = {'year': '%Y', 'month': '%Y-%m'}
+
+# read-only copy of tx_db in Arrow IPC format, for memory mapping by
+# analysis processes
+ARROW_EXPORT_FILE_NAME = 'tx_db.arrow'
+
+# dbs also kept as csv, for curating by hand
+CURATION_DBS = ['fuzzy_db', 'unknowns_db']
+
+INDEX_COLS = {db: 'date' if db == 'tx_db' else '_item' for db in DB_NAMES}
+
+# dtypes of the db columns (other than the index), for TX_DB_COLUMNS and
+# the columns of the other dbs - anything not listed is left as it is.
+# tx_db's text columns repeat a few values (or, for the items, the same
+# ones many times), so are categoricals - each distinct string is held once
+TX_DB_DTYPES = {col: 'category' for col in TX_DB_COLUMNS}
+TX_DB_DTYPES.update({'net_amt': 'float64',
+                     'y_amt': 'float64',
+                     'balance': 'float64',
+                     'id': 'Int64',
+                     'fingerprint': 'Int64'})
+
+# how dates are written out - parsing with it is much faster than guessing
+DATE_FORMAT = '%Y-%m-%d'
+
+SCHEMAS = {'tx_db': TX_DB_DTYPES,
+           'cat_db': {'accX': 'object', 'accY': 'object'},
+           'fuzzy_db': {'accX': 'object', 'accY': 'object',
+                        'status': 'object'},
+           'unknowns_db': {'accX': 'object', 'accY': 'object'},
+          }
+
+
+def get_storage(dir_path, storage=None):
+    """
+    Returns storage if passed, or else the one in the config of dir_path
+    """
+
+    if storage is None:
+        storage = load_config(dir_path)['storage']
+
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f'unknown storage {storage} - '
+                         f'should be one of {STORAGE_FORMATS}')
+
+    return storage
+
+
+def db_path(dir_path, db, storage='csv'):
+
+    if storage == 'sqlite':
+        return Path(dir_path) / SQLITE_FILE_NAME
+
+    return Path(dir_path) / (db + '.' + storage)
+
+
+def connect(dir_path):
+    """
+    Returns a connection to the sqlite store in dir_path
+    """
+
+    return sqlite3.connect(str(Path(dir_path) / SQLITE_FILE_NAME))
+
+
+def read_sql(dir_path, sql, index_col, params=None):
+    """
+    Returns the result of sql on the sqlite store in dir_path, with NULLs
+    as NaN - as missing values are read from the other formats
+    """
+
+    con = connect(dir_path)
+    df = pd.read_sql(sql, con, index_col=index_col, params=params)
+    con.close()
+
+    return df.replace({None: np.nan})
+
+
+def create_indexes(con, db):
+    """
+    Indexes the table for db on (_item, accX) and accX, and date for tx_db
+    """
+
+    index_cols = [['_item', 'accX'], ['accX']]
+    if db == 'tx_db':
+        index_cols.append(['date'])
+
+    for cols in index_cols:
+        con.execute(f'CREATE INDEX IF NOT EXISTS {db}_{"_".join(cols)} '
+                    f'ON {db} ({", ".join(cols)})')
+
+
+def apply_schema(df, db):
+    """
+    Returns df with the dtypes for db in SCHEMAS, and a datetime index for
+    tx_db
+    """
+
+    dtypes = {col: dtype for col, dtype in SCHEMAS[db].items()
+              if col in df.columns}
+    df = df.astype(dtypes)
+
+    if db == 'tx_db':
+        df.index = parse_dates(df.index)
+
+    df.index.name = INDEX_COLS[db]
+
+    return df
+
+
+def parse_dates(dates):
+    """
+    Returns dates as datetimes, parsed as DATE_FORMAT if they all are
+    """
+
+    try:
+        return pd.to_datetime(dates, format=DATE_FORMAT)
+    except (ValueError, TypeError):
+        return pd.to_datetime(dates)
+
+
+def memory_report(df, db='tx_db'):
+    """
+    Returns a df of the memory used by each column of df, and in total, in
+    bytes: 'before' with its text columns as plain strings and numbers as
+    floats (as read_csv gives them), and 'after' with the schema for db
+    """
+
+    untyped = df.astype({col: 'object' if dtype == 'category' else 'float64'
+                         for col, dtype in SCHEMAS[db].items()
+                         if col in df.columns and dtype != 'object'})
+
+    report = pd.DataFrame({'before': untyped.memory_usage(deep=True),
+                           'after': apply_schema(df, db)
+                                        .memory_usage(deep=True)})
+
+    report.loc['total'] = report.sum()
+    report['saving %'] = (100 * (1 - report['after'] / report['before'])
+                          ).round(1)
+
+    return report
+
+
+def read_db(dir_path, db, storage='csv'):
+    """
+    Returns db read from dir_path, in storage format - or from its csv
+    export, if that has been edited since
+    """
+
+    path = db_path(dir_path, db, storage)
+    csv_path = db_path(dir_path, db, 'csv')
+
+    if (storage != 'csv' and db in CURATION_DBS and csv_path.exists()
+          and csv_path.stat().st_mtime > path.stat().st_mtime):
+        print(f'reading {csv_path.name}, as it is newer than {path.name}')
+        storage, path = 'csv', csv_path
+
+    if storage == 'sqlite':
+        df = read_sql(dir_path, f'SELECT * FROM {db}', INDEX_COLS[db])
+
+    # tx_db may be partitioned, and have rows appended since it was last
+    # written in full
+    elif db == 'tx_db':
+        df = read_files(get_db_files(dir_path, db, storage), storage, db)
+
+    else:
+        df = read_file(path, storage, INDEX_COLS[db])
+
+    return apply_schema(df, db)
+
+
+def read_tx_db(dir_path=Path(), storage=None, start_date=None, end_date=None,
+               accounts=None):
+    """
+    Returns the txs in the tx_db in dir_path between start_date and
+    end_date (inclusive, either optional), and for accounts (a list of
+    accX) if passed, sorted by date.
+
+    If tx_db is partitioned, only the partitions overlapping the dates
+    and accounts are read.  With sqlite storage, the selection is made
+    in the query.
+    """
+
+    storage = get_storage(dir_path, storage)
+
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date)
+    if end_date is not None:
+        end_date = pd.Timestamp(end_date)
+
+    if storage == 'sqlite':
+        where, params = [], []
+
+        # dates are stored as text, which sorts as dates do
+        if start_date is not None:
+            where.append('date >= ?')
+            params.append(str(start_date))
+        if end_date is not None:
+            where.append('date < ?')
+            params.append(str(end_date + pd.Timedelta(days=1)))
+        if accounts is not None:
+            where.append(f'accX IN ({", ".join("?" * len(accounts))})')
+            params += list(accounts)
+
+        sql = 'SELECT * FROM tx_db'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+
+        df = read_sql(dir_path, sql, 'date', params)
+
+    else:
+        files = [x for x in get_db_files(dir_path, 'tx_db', storage)
+                 if x.parent.parent.name != PARTITIONS_DIR_NAME]
+        files += get_partitions(dir_path, storage, start_date, end_date,
+                                accounts)
+
+        df = read_files(files, storage, 'tx_db')
+
+    df = apply_schema(df, 'tx_db').sort_index(kind='mergesort')
+
+    if accounts is not None:
+        df = df[df['accX'].isin(accounts)]
+
+    return df.loc[start_date:end_date]
+
+
+def get_db_files(dir_path, db, storage='csv'):
+    """
+    Returns the paths of the existing files read_db() may read for db
+    """
+
+    files = [db_path(dir_path, db, storage)]
+
+    if storage != 'csv' and db in CURATION_DBS:
+        files.append(db_path(dir_path, db, 'csv'))
+
+    if db == 'tx_db':
+        files += get_partitions(dir_path, storage)
+        files += get_segments(dir_path, storage)
+
+    return [x for x in files if x.exists()]
+
+
+def read_file(path, storage, index_col):
+
+    if storage == 'csv':
+        return pd.read_csv(path, index_col=index_col)
+
+    if storage == 'parquet':
+        return pd.read_parquet(path).set_index(index_col)
+
+    return pd.read_feather(path).set_index(index_col)
+
+
+def read_files(files, storage, db):
+    """
+    Returns the rows of db in files, one after another - or none, with the
+    columns of db, if there are no files (eg no partitions of tx_db match)
+    """
+
+    if not files:
+        return empty_db(db)
+
+    return pd.concat([read_file(x, storage, INDEX_COLS[db]) for x in files])
+
+
+def empty_db(db):
+    """
+    Returns db with no rows, with the columns and dtypes in SCHEMAS
+    """
+
+    df = pd.DataFrame(columns=list(SCHEMAS[db]),
+                      index=pd.Index([], name=INDEX_COLS[db]))
+
+    return apply_schema(df, db)
+
+
+def write_file(df, path, storage):
+    """
+    Writes df to path in a file storage format - columnar formats get
+    df's index as a column
+
+    Written to a temp file then renamed, so a reader never sees a part
+    written file
+    """
+
+    temp_path = path.with_name(path.name + '.tmp')
+
+    if storage == 'csv':
+        df.to_csv(temp_path)
+    elif storage == 'parquet':
+        df.reset_index().to_parquet(temp_path, index=False)
+    else:
+        df.reset_index().to_feather(temp_path)
+
+    temp_path.replace(path)
+
+
+def write_db(df, dir_path, db, storage='csv', partition_by=None):
+    """
+    Writes df to dir_path as db, in storage format, plus a csv export if
+    db is one of CURATION_DBS
+
+    Writing tx_db in full replaces any segments of it.  It is written in
+    partitions if partition_by is 'year' or 'month' (see write_partitions())
+    """
+
+    if storage != 'csv':
+        # written first, so the csv is only newer if edited afterwards
+        if db in CURATION_DBS:
+            write_file(df, db_path(dir_path, db, 'csv'), 'csv')
+
+        df = apply_schema(df, db)
+
+    path = db_path(dir_path, db, storage)
+
+    if storage == 'sqlite':
+        con = connect(dir_path)
+        with con:
+            df.reset_index().to_sql(db, con, if_exists='replace',
+                                    index=False)
+            create_indexes(con, db)
+        con.close()
+
+    elif db == 'tx_db' and partition_by is not None:
+        write_partitions(df, dir_path, storage, partition_by)
+        if path.exists():
+            path.unlink()
+
+    else:
+        write_file(df, path, storage)
+
+    if db == 'tx_db':
+        if partition_by is None:
+            for partition in get_partitions(dir_path, storage):
+                partition.unlink()
+
+        for segment in get_segments(dir_path, storage):
+            segment.unlink()
+
+        refresh_arrow_export(dir_path, storage, df)
+
+
+def write_dbs(dbs, dir_path, storage=None):
+    """
+    Writes each db in the passed dict to dir_path, in storage format (by
+    default the one in the project config)
+    """
+
+    storage = get_storage(dir_path, storage)
+    partition_by = load_config(dir_path)['tx_db_partition_by']
+
+    for db in dbs:
+        write_db(dbs[db], dir_path, db, storage, partition_by)
+
+
+def get_segments(dir_path, storage='csv'):
+    """
+    Returns the paths of the tx_db segments in dir_path, in the order they
+    were written
+    """
+
+    segments_path = Path(dir_path) / SEGMENTS_DIR_NAME
+
+    if storage == 'sqlite' or not segments_path.exists():
+        return []
+
+    return sorted(segments_path.glob('*.' + storage),
+                  key=lambda x: int(x.stem))
+
+
+def append_tx_db(new_rows, dir_path, storage=None, partition_by=None,
+                 tx_db=None):
+    """
+    Adds new_rows to the tx_db in dir_path without rewriting it - as a new
+    segment file, or appended to the table with sqlite storage, or to the
+    partitions they belong in if partition_by is passed.  Returns the
+    number of segments.
+
+    Pass tx_db, the whole of it with new_rows, to refresh any Arrow export
+    from it rather than reading it back.
+    """
+
+    storage = get_storage(dir_path, storage)
+    new_rows = apply_schema(new_rows, 'tx_db')
+
+    if storage == 'sqlite':
+        con = connect(dir_path)
+        with con:
+            # eg fingerprint, for a table written before it was kept
+            table_info = con.execute('PRAGMA table_info(tx_db)').fetchall()
+            for col in new_rows.columns.difference([x[1] for x in table_info]):
+                con.execute(f'ALTER TABLE tx_db ADD COLUMN "{col}"')
+
+            new_rows.reset_index().to_sql('tx_db', con, if_exists='append',
+                                          index=False)
+        con.close()
+
+    elif partition_by is not None:
+        append_partitions(new_rows, dir_path, storage, partition_by)
+
+    else:
+        segments = get_segments(dir_path, storage)
+        number = int(segments[-1].stem) + 1 if segments else 0
+
+        segments_path = Path(dir_path) / SEGMENTS_DIR_NAME
+        segments_path.mkdir(exist_ok=True)
+
+        write_file(new_rows, segments_path / f'{number:06d}.{storage}',
+                   storage)
+
+    refresh_arrow_export(dir_path, storage, tx_db)
+
+    return len(get_segments(dir_path, storage))
+
+
+def make_staging_path(dir_path):
+    """
+    Returns a new, empty dir in dir_path to stage tx_db segments in
+    """
+
+    staging_root = Path(dir_path) / STAGING_DIR_NAME
+    staging_root.mkdir(exist_ok=True)
+
+    return Path(mkdtemp(dir=staging_root))
+
+
+def stage_segment(new_rows, staging_path, storage='csv'):
+    """
+    Writes new_rows of tx_db to staging_path (see make_staging_path()), as
+    the next of the segments staged there.  They are not read with tx_db
+    until added to it by publish_segments().
+    """
+
+    staging_path = Path(staging_path)
+    number = len(list(staging_path.glob('*.' + storage)))
+
+    write_file(apply_schema(new_rows, 'tx_db'),
+               staging_path / f'{number:06d}.{storage}', storage)
+
+
+def publish_segments(staging_path, dir_path, storage=None, tx_db=None):
+    """
+    Adds the segments staged in staging_path to the tx_db in dir_path,
+    after its own and in the order staged, and removes staging_path.
+    Returns the number of segments.
+
+    Pass tx_db, the whole of it with the staged rows, to refresh any Arrow
+    export from it rather than reading it back.
+    """
+
+    storage = get_storage(dir_path, storage)
+
+    segments = get_segments(dir_path, storage)
+    number = int(segments[-1].stem) + 1 if segments else 0
+
+    segments_path = Path(dir_path) / SEGMENTS_DIR_NAME
+    segments_path.mkdir(exist_ok=True)
+
+    for path in sorted(Path(staging_path).glob('*.' + storage)):
+        path.replace(segments_path / f'{number:06d}.{storage}')
+        number += 1
+
+    rmtree(staging_path)
+    refresh_arrow_export(dir_path, storage, tx_db)
+
+    return len(get_segments(dir_path, storage))
+
+
+def compact_tx_db(dir_path, storage=None):
+    """
+    Rewrites the tx_db in dir_path in full, merging in its segments
+    """
+
+    storage = get_storage(dir_path, storage)
+    write_db(read_db(dir_path, 'tx_db', storage), dir_path, 'tx_db', storage,
+             load_config(dir_path)['tx_db_partition_by'])
+
+
+def get_partition_keys(df, partition_by='year'):
+    """
+    Returns arrays of the accX and period of each row of tx_db df, where
+    the period is eg '2020' by year or '2020-01' by month, to group by
+    """
+
+    return [df['accX'].astype(str).values,
+            df.index.strftime(PARTITION_FORMATS[partition_by]).values]
+
+
+def get_partition_path(dir_path, accX, period, storage):
+    return Path(dir_path) / PARTITIONS_DIR_NAME / accX / (period + '.' + storage)
+
+
+def write_partitions(df, dir_path, storage='csv', partition_by='year'):
+    """
+    Writes tx_db df in partitions by account and period, replacing any
+    already in dir_path
+    """
+
+    for partition in get_partitions(dir_path, storage):
+        partition.unlink()
+
+    groups = df.groupby(get_partition_keys(df, partition_by), sort=False)
+
+    for (accX, period), partition in groups:
+        path = get_partition_path(dir_path, accX, period, storage)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_file(partition, path, storage)
+
+
+def append_partitions(new_rows, dir_path, storage='csv', partition_by='year'):
+    """
+    Adds new_rows to the tx_db partitions in dir_path, rewriting only the
+    partitions they belong in
+    """
+
+    groups = new_rows.groupby(get_partition_keys(new_rows, partition_by),
+                              sort=False)
+
+    for (accX, period), rows in groups:
+        path = get_partition_path(dir_path, accX, period, storage)
+
+        if path.exists():
+            rows = pd.concat([apply_schema(read_file(path, storage, 'date'),
+                                           'tx_db'),
+                              rows])
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+        write_file(rows, path, storage)
+
+
+def get_partitions(dir_path, storage='csv', start_date=None, end_date=None,
+                   accounts=None):
+    """
+    Returns the paths of the tx_db partitions in dir_path, optionally only
+    those for accounts and overlapping start_date to end_date
+    """
+
+    partitions_path = Path(dir_path) / PARTITIONS_DIR_NAME
+
+    if storage == 'sqlite' or not partitions_path.exists():
+        return []
+
+    partitions = []
+
+    for path in sorted(partitions_path.glob('*/*.' + storage)):
+        accX, period = path.parent.name, path.stem
+
+        if accounts is not None and accX not in accounts:
+            continue
+
+        # periods compare as strings, at their own precision
+        date_format = (PARTITION_FORMATS['year'] if len(period) == 4
+                       else PARTITION_FORMATS['month'])
+
+        if start_date is not None and period < start_date.strftime(date_format):
+            continue
+        if end_date is not None and period > end_date.strftime(date_format):
+            continue
+
+        partitions.append(path)
+
+    return partitions
+
+
+def refresh_arrow_export(dir_path, storage=None, tx_db=None):
+    """
+    If 'tx_db_arrow_export' is set in the project config, rewrites the
+    read-only export of tx_db in dir_path (see open_arrow_export()), from
+    the passed tx_db or else the stored one
+    """
+
+    if not load_config(dir_path)['tx_db_arrow_export']:
+        return
+
+    from pyarrow import feather
+
+    if tx_db is None:
+        tx_db = read_db(dir_path, 'tx_db', get_storage(dir_path, storage))
+
+    path = Path(dir_path) / ARROW_EXPORT_FILE_NAME
+    temp_path = path.with_suffix('.tmp')
+
+    # uncompressed, so it can be memory mapped
+    feather.write_feather(apply_schema(tx_db, 'tx_db').reset_index(),
+                          str(temp_path), compression='uncompressed')
+
+    # replaced in one step - processes with the old file mapped keep it
+    temp_path.replace(path)
+
+
+def open_arrow_export(dir_path=Path(), to_pandas=True):
+    """
+    Returns the read-only export of tx_db in dir_path, memory mapped, so
+    processes opening it share one copy in the page cache.  Pass
+    to_pandas=False for the pyarrow Table, which is not copied at all.
+    """
+
+    import pyarrow as pa
+
+    source = pa.memory_map(str(Path(dir_path) / ARROW_EXPORT_FILE_NAME))
+    table = pa.ipc.open_file(source).read_all()
+
+    if not to_pandas:
+        return table
+
+    return table.to_pandas().set_index('date')
+
+
+def migrate_dbs(dir_path, storage='parquet'):
+    """
+    Writes the csv dbs in dir_path out in another storage format.  The
+    csvs are left in place - set 'storage' in config.json to use the new
+    files.
+    """
+
+    dir_path = Path(dir_path)
+
+    for db in DB_NAMES:
+        write_db(read_db(dir_path, db, 'csv'), dir_path, db, storage)
+        print('migrated', db, 'to', db_path(dir_path, db, storage))
+
+    print(f'set "storage": "{storage}" in', dir_path / 'config.json',
+          'to use them')
@@ -0,0 +1,23 @@
+# myfin/finance/helpers/load_config.py
+
+import json
+from pathlib import Path
+
+from .constants import DEFAULT_CONFIG
+
+def load_config(proj_path=Path()):
+    """
+    Returns a dict of project settings: DEFAULT_CONFIG, updated with 
+    anything in config.json in proj_path (which is optional)
+    """
+
+    config = dict(DEFAULT_CONFIG)
+
+    config_path = Path(proj_path) / 'config.json'
+
+    if config_path.exists():
+        with config_path.open() as fp:
+            config.update(json.load(fp))
+
+    return config
+
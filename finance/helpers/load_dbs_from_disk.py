@@ -1,26 +1,82 @@
 # finance.helpers.load_dbs_from_disk.py
 
 from pathlib import Path
-import pandas as pd
 
 from .constants import DB_NAMES
+from .db_storage import get_storage, get_db_files, read_db
 
-def load_dbs_from_disk(dir_path=Path()):
+# dbs already read in this process: {(dir, db, storage): (signature, df)}
+_cache = {}
+
+def load_dbs_from_disk(dir_path=Path(), storage=None, db_names=None,
+                       use_cache=True):
     """
     Loads dbs from disk, returning a dict
+
+    storage is the format to read (see db_storage.py) - by default the
+    one in the project config.  Pass db_names to only load some dbs.
+
+    Dbs are cached in the process, and not read again if the modified
+    time and size of their files are unchanged.  Copies are returned, so
+    changes to them do not change the cache.
     """
 
     dir_path = Path(dir_path)
+    storage = get_storage(dir_path, storage)
+
+    if db_names is None:
+        db_names = DB_NAMES
 
     dbs = {}
 
-    for db in DB_NAMES:
-        dbs[db] = pd.read_csv(dir_path / (db + '.csv'),
-                              index_col='date' if db == 'tx_db' else '_item')
+    for db in db_names:
+
+        if not use_cache:
+            dbs[db] = read_db(dir_path, db, storage)
+            continue
+
+        key = (str(dir_path.resolve()), db, storage)
+        signature = get_signature(get_db_files(dir_path, db, storage))
 
-    dbs['tx_db'].index = pd.to_datetime(dbs['tx_db'].index)
+        if key not in _cache or _cache[key][0] != signature:
+            _cache[key] = (signature, read_db(dir_path, db, storage))
+
+        dbs[db] = _cache[key][1].copy()
 
     return dbs
 
 
+def get_dbs_signature(dir_path=Path(), storage=None, db_names=None):
+    """
+    Returns a dict of the signature of the files of each db - if it is
+    unchanged, so are the dbs on disk
+    """
+
+    dir_path = Path(dir_path)
+    storage = get_storage(dir_path, storage)
+
+    if db_names is None:
+        db_names = DB_NAMES
+
+    return {db: get_signature(get_db_files(dir_path, db, storage))
+            for db in db_names}
+
+
+def get_signature(paths):
+    """
+    Returns the name, modified time and size of each of paths
+    """
+
+    signature = []
+    for path in paths:
+        stat = path.stat()
+        signature.append((path.name, stat.st_mtime_ns, stat.st_size))
+
+    return tuple(signature)
+
+
+def clear_cache():
+    _cache.clear()
+
+
 
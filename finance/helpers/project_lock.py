@@ -0,0 +1,43 @@
+# myfin/finance/helpers/project_lock.py
+
+import fcntl
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+"""
+A lock on a project dir, held while writing its dbs, so that loaders for
+different accounts can run at the same time - see the merge on writing in
+load_new_txs().  Uses flock, so is released if the process dies.
+"""
+
+LOCK_FILE_NAME = '.dbs.lock'
+
+
+@contextmanager
+def project_lock(proj_path, timeout=None, poll_interval=0.1):
+    """
+    Context manager holding an exclusive lock on the project at proj_path,
+    waiting up to timeout seconds for it (or for as long as it takes)
+    """
+
+    lock_path = Path(proj_path) / LOCK_FILE_NAME
+    started = time.monotonic()
+
+    with lock_path.open('a') as fp:
+
+        while True:
+            try:
+                fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if (timeout is not None
+                      and time.monotonic() - started > timeout):
+                    raise TimeoutError(f'could not lock {proj_path} '
+                                       f'in {timeout} seconds')
+                time.sleep(poll_interval)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
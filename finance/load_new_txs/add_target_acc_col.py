@@ -1,15 +1,51 @@
 import pandas as pd
-from fuzzywuzzy import fuzz, process
 
+from finance.helpers.constants import DEFAULT_CONFIG
 
-def add_target_acc_col(df, acc_name, dbs):
+from .batch_fuzzy_match import batch_fuzzy_match, SCORERS
+from .gram_index import get_candidates
+from .match_cache import lookup_matches, store_matches
+from .make_lookups import make_lookups, pick_from_lookup
+from .tfidf_match import tfidf_match
+from .target_rules import apply_target_rules
+
+
+def add_target_acc_col(df, acc_name, dbs, lookups=None, target_rules=None,
+                       gram_index=None, match_cache=None, tfidf_model=None,
+                       config=None):
     """
     Get target account assignments (categories)
+
+    Pass lookups of the dbs (from make_lookups()) if making several calls
+    with the same dbs, to avoid rebuilding them each time, and any compiled
+    target_rules (see target_rules.py)
+
+    Optionally pass a gram_index of cat_db to prune fuzzy matching, with
+    settings taken from config (see DEFAULT_CONFIG), and a match_cache of
+    previous fuzzy match results.  Passing a tfidf_model (see
+    tfidf_match.py) uses that instead of fuzzywuzzy.
     """
+    if config is None:
+        config = DEFAULT_CONFIG
+
     accYs = assign_targets(df._item, acc_name,
                                 unknowns_db=dbs['unknowns_db'],
                                 fuzzy_db=dbs['fuzzy_db'],
-                                cat_db=dbs['cat_db'])
+                                cat_db=dbs['cat_db'],
+                                lookups=lookups,
+                                target_rules=target_rules,
+                                gram_index=gram_index,
+                                match_cache=match_cache,
+                                tfidf_model=tfidf_model,
+                                fuzzy_threshold=config['fuzzy_threshold'],
+                                scorers=config['fuzzy_scorers'],
+                                short_circuit=config['fuzzy_short_circuit'],
+                                top_n=config['gram_index_top_n'],
+                                min_shared=config['gram_index_min_shared'],
+                                n_workers=config['fuzzy_workers'],
+                                min_parallel_items=
+                                    config['fuzzy_parallel_min_items'],
+                                account_first=config['fuzzy_account_first'])
 
     # make a df with accY, accY and mode columns
     df['accY'] = [x[0] for x in accYs]
@@ -20,78 +56,191 @@ def add_target_acc_col(df, acc_name, dbs):
 
 def assign_targets(_items, account,
                    cat_db=None, unknowns_db=None, fuzzy_db=None,
-                   fuzzymatch=True, fuzzy_threshold=75):
+                   fuzzymatch=True, fuzzy_threshold=55, lookups=None,
+                   target_rules=None,
+                   gram_index=None, match_cache=None, tfidf_model=None,
+                   scorers=SCORERS, short_circuit=100, top_n=50, min_shared=1,
+                   n_workers=1, min_parallel_items=200, account_first=False):
     """
     - take iterable of items - eg column of new_tx df
     - iterate over items (df.apply is not faster), generating matches
-      (and the 'mode' of the match) vs ref dbs (loaded in RAM)
+      (and the 'mode' of the match) vs ref dbs (loaded in RAM), using
+      dict lookups of them (made here if not passed - see make_lookups.py)
+    - if target_rules are passed, they are applied to all items in one
+      pass first, and hits used before looking in cat_db
+    - items not found in any db are then fuzzy matched against cat_db
+      together, in one call to batch_fuzzy_match(), running the passed
+      scorers in order and stopping for an item once one reaches
+      short_circuit
+    - if a gram_index is passed, each is only fuzzy matched against the
+      top_n cat_db keys sharing most grams with it (see gram_index.py)
+    - if a match_cache is passed, items found in it are not fuzzy matched
+      again, and new results are added to it (see match_cache.py)
+    - if a tfidf_model is passed, items are matched with tfidf_match()
+      instead (with the same threshold), and scorers, gram_index etc
+      are not used
+    - with n_workers > 1, fuzzy matching is split across that many
+      processes if there are at least min_parallel_items to match
+    - with account_first, items are fuzzy matched against the cat_db keys
+      of account first, and only those without a hit against all of them
+      (not with a tfidf_model, which covers all keys)
     - returns list of tuples: (hit target, mode of assignment)
 
     """
 
-    results = []
-    for _item in _items:
+    _items = list(_items)
+    results = [None] * len(_items)
+
+    if lookups is None:
+        lookups = make_lookups({'cat_db': cat_db,
+                                'fuzzy_db': fuzzy_db,
+                                'unknowns_db': unknowns_db})
+
+    no_lookup = {'by_acc': {}, 'first': {}}
+    unknowns_lookup = lookups.get('unknowns_db', no_lookup)
+    cat_lookup = lookups.get('cat_db', no_lookup)
+    fuzzy_lookup = lookups.get('fuzzy_db', no_lookup)
+
+    rule_hits = {}
+    if target_rules is not None:
+        rule_hits = apply_target_rules(_items, target_rules)
+
+    # positions in _items of those to fuzzy match
+    to_match = []
+
+    for i, _item in enumerate(_items):
 
 
         #    TEST                     -> TUPLE TO APPEND TO RESULTS
         # 1. is in unknowns_db?       -> ('unknown', 'old unknown')
-        # 2. is in cat_db?            -> (<the hit>, 'known'      )
-        # 3. is in fuzzy_db?          -> (<the hit>, 'old fuzzy'  )
-        # 4. fuzzy match in tx_db?    -> (<the hit>, 'new fuzzy'  )
-        # 5. ..else assign 'unknown'  -> ('unknown', 'new unknown')
-
-        if (unknowns_db is not None
-              and len(unknowns_db) > 0
-              and unknowns_db.index.contains(_item)):
+        # 2. matches a target rule?   -> (<the hit>, 'rule match' )
+        # 3. is in cat_db?            -> (<the hit>, 'known'      )
+        # 4. is in fuzzy_db?          -> (<the hit>, 'old fuzzy'  )
+        # 5. fuzzy match in tx_db?    -> (<the hit>, 'new fuzzy'  )
+        # 6. ..else assign 'unknown'  -> ('unknown', 'new unknown')
+
+        if _item in unknowns_lookup['first']:
+            results[i] = ('unknown', 'looked up unknown')
+            continue
 
-            results.append(('unknown', 'looked up unknown'))
+        if _item in rule_hits:
+            results[i] = (rule_hits[_item], 'rule match')
             continue
 
-        if cat_db is not None and cat_db.index.contains(_item):
-            hits = cat_db.loc[[_item]]
-            results.append((pick_match(_item, account, hits), 'looked up known'))
+        if _item in cat_lookup['first']:
+            results[i] = (pick_from_lookup(cat_lookup, _item, account),
+                          'looked up known')
             continue
 
-        if fuzzy_db is not None and fuzzy_db.index.contains(_item):
-            hits = fuzzy_db.loc[[_item]]
-            results.append((pick_match(_item, account, hits), 'looked up fuzzy'))
+        if _item in fuzzy_lookup['first']:
+            results[i] = (pick_from_lookup(fuzzy_lookup, _item, account),
+                          'looked up fuzzy')
             continue
 
         if fuzzymatch and cat_db is not None:
-            fuzzy_hit = make_fuzzy_match(_item, cat_db.index.values)
+            to_match.append(i)
+            continue
 
-            if fuzzy_hit:
-                hits = cat_db.loc[[fuzzy_hit]]
-                results.append((pick_match(fuzzy_hit, account, hits),
-                                'fuzzy match'))
-                continue
+        results[i] = ('unknown', 'new unknown')
+
+    # 5. (and 6.) for everything left, all at once
+    if to_match:
+        items_to_match = [_items[i] for i in to_match]
+
+        # with account_first, hits depend on the account too
+        def cache_key(_item):
+            return f'{account}\t{_item}' if account_first else _item
 
-        results.append(('unknown', 'new unknown'))
+        fuzzy_hits = {}
+        if match_cache is not None:
+            cached = lookup_matches(match_cache,
+                                    map(cache_key, items_to_match))
+            fuzzy_hits = {x: cached[cache_key(x)] for x in items_to_match
+                          if cache_key(x) in cached}
+
+        new_items = [x for x in dict.fromkeys(items_to_match)
+                     if x not in fuzzy_hits]
+
+        match_kwargs = dict(gram_index=gram_index, tfidf_model=tfidf_model,
+                            threshold=fuzzy_threshold, scorers=scorers,
+                            short_circuit=short_circuit, top_n=top_n,
+                            min_shared=min_shared, n_workers=n_workers,
+                            min_parallel_items=min_parallel_items)
+
+        new_hits = {}
+        if new_items and account_first and tfidf_model is None:
+            home_keys = cat_db.index.values[cat_db['accX'].values == account]
+            home_hits = fuzzy_match_items(new_items, home_keys,
+                                          **match_kwargs)
+
+            new_hits = {x: hit for x, hit in zip(new_items, home_hits)
+                        if hit[0]}
+
+        rest = [x for x in new_items if x not in new_hits]
+
+        if rest:
+            new_hits.update(zip(rest, fuzzy_match_items(rest,
+                                                        cat_db.index.values,
+                                                        **match_kwargs)))
+
+        if new_hits:
+            if match_cache is not None:
+                store_matches(match_cache, {cache_key(x): new_hits[x]
+                                            for x in new_hits})
+
+            fuzzy_hits.update(new_hits)
+
+        for i in to_match:
+            fuzzy_hit, score = fuzzy_hits[_items[i]]
+
+            if fuzzy_hit:
+                results[i] = (pick_from_lookup(cat_lookup, fuzzy_hit, account),
+                              'fuzzy match')
+            else:
+                results[i] = ('unknown', 'new unknown')
 
     return results
 
 
-def make_fuzzy_match(input_string, reference_set, threshold=55):
+def fuzzy_match_items(items, reference_set, gram_index=None,
+                      tfidf_model=None, threshold=55, scorers=SCORERS,
+                      short_circuit=100, top_n=50, min_shared=1, n_workers=1,
+                      min_parallel_items=200):
+    """
+    Returns a list of (hit, score) tuples for items against reference_set,
+    with tfidf_match() if a tfidf_model is passed (which always matches
+    against the keys it was built from), or else batch_fuzzy_match(),
+    pruned with the gram_index if passed
+    """
 
-    matches = {}
+    if tfidf_model is not None:
+        return tfidf_match(items, tfidf_model, threshold=threshold)
 
-    scorers = { 'ratio': fuzz.ratio,
-                # 'partial_ratio': fuzz.partial_ratio,
-                'token_set_ratio': fuzz.token_set_ratio,
-                'token_sort_ratio': fuzz.token_sort_ratio,
-              }
+    candidates = None
+    if gram_index is not None:
+        candidates = get_candidates(items, reference_set, gram_index,
+                                    top_n=top_n, min_shared=min_shared)
 
-    for scorer in scorers: 
-        matches[scorer] = process.extractOne(input_string, reference_set,
-                                             scorer=scorers[scorer])
+    return batch_fuzzy_match(items, reference_set,
+                             threshold=threshold,
+                             candidates=candidates,
+                             scorers=scorers,
+                             short_circuit=short_circuit,
+                             n_workers=n_workers,
+                             min_parallel_items=min_parallel_items)
 
-    top_hit = max(matches, key=lambda x: matches[x][1])
 
-    if matches[top_hit][1] >= threshold:
-        return matches[top_hit][0]
+def make_fuzzy_match(input_string, reference_set, threshold=55,
+                     scorers=SCORERS, short_circuit=100):
+    """
+    Returns the best fuzzy hit for input_string in reference_set, or False
+    if none reaches threshold.  See batch_fuzzy_match() for many at once,
+    and for how scorers and short_circuit are used.
+    """
 
-    else:
-        return False
+    return batch_fuzzy_match([input_string], reference_set,
+                             threshold=threshold, scorers=scorers,
+                             short_circuit=short_circuit)[0][0]
 
 
 def pick_match(item, account, hits, return_col='accY'):
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 def append_to_all_dbs(df, dbs):
@@ -21,7 +22,7 @@ def append_to_fuzzy_db(df, fuzzy_db):
     new_fuzzies['status'] = 'unconfirmed'
     new_fuzzies = new_fuzzies[fuzzy_db.columns]
 
-    return tidy(fuzzy_db.append(new_fuzzies))
+    return merge_sorted(fuzzy_db, new_fuzzies)
 
 
 def append_to_unknowns_db(df, unknowns_db):
@@ -30,9 +31,8 @@ def append_to_unknowns_db(df, unknowns_db):
     """
     new_unknowns = (df.loc[df['mode'] == 'new unknown']
                      .set_index('_item', drop=True))
-    unknowns_db = unknowns_db.append(new_unknowns[unknowns_db.columns])
 
-    return tidy(unknowns_db)
+    return merge_sorted(unknowns_db, new_unknowns[unknowns_db.columns])
 
 
 def append_to_tx_db(df, tx_db):
@@ -57,9 +57,89 @@ def append_to_tx_db(df, tx_db):
 
 
 def tidy(df):
+    """
+    Drops duplicates and sorts by all columns, the index first
+    """
     orig_index = df.index.names
     out = df.reset_index().drop_duplicates()
     out = out.sort_values(list(out.columns))
     return out.set_index(orig_index)
 
 
+def is_tidy(df):
+    """
+    Returns whether df is as tidy() would leave it
+    """
+
+    if not df.index.is_monotonic_increasing:
+        return False
+
+    # only rows sharing an index value can be out of order or duplicates
+    repeats = df[df.index.duplicated(keep=False)]
+
+    return repeats.equals(tidy(repeats))
+
+
+def ensure_tidy_dbs(dbs):
+    """
+    Makes sure fuzzy_db and unknowns_db in dbs are tidy, as append_to_all_dbs()
+    needs them to be
+    """
+
+    for db in ['fuzzy_db', 'unknowns_db']:
+        dbs[db] = ensure_tidy(dbs[db])
+
+    return dbs
+
+
+def ensure_tidy(df):
+    """
+    Returns df tidied, if it is not already (eg a curated csv edited by
+    hand) - so it can be appended to with merge_sorted()
+    """
+
+    if is_tidy(df):
+        return df
+
+    return tidy(df)
+
+
+def merge_sorted(db, new_rows):
+    """
+    Returns tidy(db + new_rows) for a db that is already tidy, without
+    sorting all of it: new_rows and the rows of db with the same index
+    values are tidied together, and spliced in where those values go
+    (found by binary search)
+    """
+
+    if new_rows.empty:
+        return db
+
+    new_rows = tidy(new_rows)
+    keys = new_rows.index.unique()
+
+    try:
+        starts = db.index.searchsorted(keys, side='left')
+        ends = db.index.searchsorted(keys, side='right')
+    except TypeError:
+        # keys that do not compare with db's, eg nan
+        return tidy(pd.concat([db, new_rows]))
+
+    # positions in db of the rows sharing a key with new_rows
+    lengths = ends - starts
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths)
+                                                   - lengths, lengths)
+    shared = np.repeat(starts, lengths) + offsets
+
+    merged = tidy(pd.concat([db.iloc[shared], new_rows]))
+
+    # each merged row goes before the first kept row after its key
+    kept = np.delete(np.arange(len(db)), shared)
+    key_positions = starts - (np.cumsum(lengths) - lengths)
+    inserts = key_positions[keys.get_indexer(merged.index)]
+
+    order = np.insert(kept, inserts, len(db) + np.arange(len(merged)))
+
+    return pd.concat([db, merged]).iloc[order]
+
+
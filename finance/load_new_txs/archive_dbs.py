@@ -1,41 +1,247 @@
 # myfin/finance/load_new_txs/archive_dbs.py
 
+import gzip
+import json
+from datetime import datetime, timedelta
+from hashlib import sha1
 from pathlib import Path
-import pandas as pd
-from shutil import copy
+from shutil import copyfileobj, rmtree
 
 from finance.helpers.constants import DB_NAMES
+from finance.helpers.db_storage import (get_storage, db_path, get_db_files,
+                                        refresh_arrow_export, CURATION_DBS,
+                                        SEGMENTS_DIR_NAME, PARTITIONS_DIR_NAME)
+from finance.helpers.load_config import load_config
 
-def archive_dbs(proj_path=None, annotation=None, archive_path=None):
+"""
+Snapshots of the dbs, in db_archive/ in the project dir.
+
+Each file making up the dbs is stored once, gzipped, as objects/<sha1>.gz
+(the sha1 of its contents), so a db that has not changed since the last
+snapshot takes no more space.  manifest.json lists the snapshots, oldest
+first, each with the object for every file:
+
+    {"timestamp": "20200131_120000_000000", "annotation": "loaded_acc1",
+     "storage": "csv", "files": [["tx_db.csv", <sha1>], ...]}
+
+Timestamps are unique, and sort as strings in the order the snapshots
+were made.  restore_snapshot() writes a snapshot's files back to the
+project dir.
+Old snapshots are pruned to the project config's 'archive_keep_last',
+plus the last of each day for 'archive_keep_days' days.
+"""
+
+MANIFEST_FILE_NAME = 'manifest.json'
+OBJECTS_DIR_NAME = 'objects'
+TS_FORMAT = '%Y%m%d_%H%M%S_%f'
+
+
+def archive_dbs(proj_path=None, annotation=None, archive_path=None,
+                storage=None):
     """
-    Save a snapshot of the 4 dbs
+    Save a snapshot of the 4 dbs, in their storage format (by default the
+    one in the project config)
     """
 
     if proj_path is None:
         proj_path = Path()
 
-    proj_name = proj_path.name
+    proj_path = Path(proj_path)
 
     if archive_path is None:
         archive_path = proj_path / 'db_archive'
 
-    if not Path(archive_path).exists():
-        Path(archive_path).mkdir()
+    archive_path = Path(archive_path)
+    (archive_path / OBJECTS_DIR_NAME).mkdir(parents=True, exist_ok=True)
+
+    storage = get_storage(proj_path, storage)
+    manifest = load_manifest(archive_path)
+
+    snapshot = {'timestamp': make_timestamp(manifest),
+                'annotation': annotation,
+                'storage': storage,
+                'files': []}
+
+    for path in get_files_to_archive(proj_path, storage):
+        snapshot['files'].append([path.relative_to(proj_path).as_posix(),
+                                  store_object(path, archive_path)])
+
+    manifest.append(snapshot)
 
-    ts = pd.datetime.now().strftime("%Y%m%d_%H%M")
+    config = load_config(proj_path)
+    manifest = prune_snapshots(manifest,
+                               keep_last=config['archive_keep_last'],
+                               keep_days=config['archive_keep_days'])
 
+    save_manifest(manifest, archive_path)
+    remove_unused_objects(manifest, archive_path)
 
-    if annotation is None:
-        annotation = ""
-    else:
-        annotation = "_" + annotation
+    return snapshot['timestamp']
 
+
+def make_timestamp(manifest):
+    """
+    Returns the timestamp for a new snapshot - now, or if that is not
+    after the last snapshot in manifest (made in the same microsecond, or
+    the clock has gone back), a microsecond after it
+    """
+
+    now = datetime.now()
+
+    if manifest:
+        last = datetime.strptime(manifest[-1]['timestamp'], TS_FORMAT)
+        now = max(now, last + timedelta(microseconds=1))
+
+    return now.strftime(TS_FORMAT)
+
+
+def get_files_to_archive(proj_path, storage):
+    """
+    Returns the paths of the files making up the dbs, in the order to
+    restore them - csv exports before the stored dbs, so those are newer
+    """
+
+    files = []
+
+    if storage != 'csv':
+        files += [db_path(proj_path, db, 'csv') for db in CURATION_DBS
+                  if db_path(proj_path, db, 'csv').exists()]
+
+    # the sqlite store holds all the dbs in one file
+    if storage == 'sqlite':
+        return files + [db_path(proj_path, 'tx_db', storage)]
+
+    # tx_db may be in partitions and segments
     for db in DB_NAMES:
+        files += [x for x in get_db_files(proj_path, db, storage)
+                  if x.suffix != '.csv' or storage == 'csv']
+
+    return files
+
+
+def store_object(path, archive_path):
+    """
+    Adds the file at path to the objects in archive_path, if not there
+    already, and returns its hash
+    """
+
+    digest = sha1()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(block)
+
+    object_path = archive_path / OBJECTS_DIR_NAME / (digest.hexdigest() + '.gz')
+
+    if not object_path.exists():
+        temp_path = object_path.with_suffix('.tmp')
+
+        with open(path, 'rb') as fp_in, gzip.open(temp_path, 'wb') as fp_out:
+            copyfileobj(fp_in, fp_out)
+
+        temp_path.replace(object_path)
+
+    return digest.hexdigest()
+
+
+def load_manifest(archive_path):
+
+    manifest_path = Path(archive_path) / MANIFEST_FILE_NAME
+
+    if not manifest_path.exists():
+        return []
 
-        dir_out = archive_path / db
-        if not Path(dir_out).exists():
-            Path(dir_out).mkdir()
+    with manifest_path.open() as fp:
+        return json.load(fp)
+
+
+def save_manifest(manifest, archive_path):
+
+    manifest_path = Path(archive_path) / MANIFEST_FILE_NAME
+    temp_path = manifest_path.with_suffix('.tmp')
+
+    with temp_path.open('w') as fp:
+        json.dump(manifest, fp, indent=1)
+
+    temp_path.replace(manifest_path)
+
+
+def restore_snapshot(timestamp, proj_path=None, archive_path=None):
+    """
+    Writes the dbs in the snapshot with timestamp (or the latest before
+    it, eg passing just a date) back to proj_path, replacing the current
+    ones, and refreshes any Arrow export of tx_db (which snapshots do not
+    keep).  Returns the snapshot restored, or None if there is none.
+
+    Set 'storage' in the project config to the snapshot's to use them.
+    """
+
+    if proj_path is None:
+        proj_path = Path()
+
+    proj_path = Path(proj_path)
+
+    if archive_path is None:
+        archive_path = proj_path / 'db_archive'
+
+    archive_path = Path(archive_path)
+
+    # timestamps sort as strings, so pad to the latest with that start
+    timestamp = str(timestamp)
+    timestamp += '99999999_999999_999999'[len(timestamp):]
+    earlier = [x for x in load_manifest(archive_path)
+               if x['timestamp'] <= timestamp]
+
+    if not earlier:
+        print('no snapshot at or before', timestamp)
+        return None
+
+    snapshot = earlier[-1]
+
+    # segments and partitions not in the snapshot would be read with tx_db
+    for dir_name in [SEGMENTS_DIR_NAME, PARTITIONS_DIR_NAME]:
+        if (proj_path / dir_name).exists():
+            rmtree(proj_path / dir_name)
+
+    for name, digest in snapshot['files']:
+        path = proj_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        object_path = archive_path / OBJECTS_DIR_NAME / (digest + '.gz')
+        with gzip.open(object_path, 'rb') as fp_in, open(path, 'wb') as fp_out:
+            copyfileobj(fp_in, fp_out)
+
+    refresh_arrow_export(proj_path, snapshot['storage'])
+
+    print(f'restored snapshot {snapshot["timestamp"]}',
+          f'({snapshot["annotation"]}), with {snapshot["storage"]} storage')
+
+    return snapshot
+
+
+def prune_snapshots(manifest, keep_last=20, keep_days=90):
+    """
+    Returns manifest with only the last keep_last snapshots, and the last
+    snapshot of each of the last keep_days days with any
+    """
+
+    last_of_day = {}
+    for i, snapshot in enumerate(manifest):
+        last_of_day[snapshot['timestamp'][:8]] = i
+
+    keep = set(range(max(len(manifest) - keep_last, 0), len(manifest)))
+    if keep_days:
+        keep.update(sorted(last_of_day.values())[-keep_days:])
+
+    return [x for i, x in enumerate(manifest) if i in keep]
+
+
+def remove_unused_objects(manifest, archive_path):
+    """
+    Deletes objects in archive_path not in any snapshot in manifest
+    """
 
-        copy(str(proj_path / (db + '.csv')), 
-             str(dir_out / (ts + annotation + '.csv') ))
+    in_use = {digest for x in manifest for name, digest in x['files']}
 
+    for object_path in (Path(archive_path) / OBJECTS_DIR_NAME).glob('*.gz'):
+        if object_path.stem not in in_use:
+            object_path.unlink()
@@ -0,0 +1,301 @@
+# myfin/finance/load_new_txs/batch_fuzzy_match.py
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+
+
+# scorers in the order make_fuzzy_match has always tried them - where two
+# scorers give the same top score, the first one's hit is kept
+SCORERS = ['ratio', 'token_set_ratio', 'token_sort_ratio']
+
+
+def _full_process_ascii(s):
+    return utils.full_process(s, force_ascii=True)
+
+
+def _process_and_sort(s):
+    return " ".join(sorted(_full_process_ascii(s).split()))
+
+
+def _token_set_ratio(s1, s2):
+    return fuzz.token_set_ratio(s1, s2, full_process=False)
+
+
+# how process.extractOne prepares strings for each scorer, and the scorer
+# to apply to the prepared strings
+PREPROCESSORS = {'ratio': utils.full_process,
+                 'partial_ratio': utils.full_process,
+                 'token_set_ratio': _full_process_ascii,
+                 'token_sort_ratio': _process_and_sort,
+                }
+
+SCORE_FUNCS = {'ratio': fuzz.ratio,
+               'partial_ratio': fuzz.partial_ratio,
+               'token_set_ratio': _token_set_ratio,
+               'token_sort_ratio': fuzz.ratio,
+              }
+
+# scorers that are a plain ratio of the prepared strings, so can be no more
+# than length_bound() - used to skip references that cannot reach a cutoff
+BOUNDED_SCORERS = ['ratio', 'token_sort_ratio']
+
+
+def batch_fuzzy_match(items, reference_set, threshold=55, candidates=None,
+                      scorers=SCORERS, short_circuit=100,
+                      n_workers=1, min_parallel_items=200, max_cells=10**7):
+    """
+    Fuzzy matches all of items against reference_set in one call.
+
+    Returns a list aligned with items of (hit, score) tuples, where hit
+    is False if no scorer reaches threshold.
+
+    Gives the same hits as running process.extractOne for each item with
+    each of scorers and taking the best, but each reference string is
+    processed once per scorer (not once per item per scorer), each distinct
+    item is scored once, and scores are collected in an items x references
+    matrix per scorer (built in blocks of at most max_cells).
+
+    Scorers are run in the order passed (so put cheap ones first).  After
+    the first, a scorer only changes an item's hit if it beats the best
+    score so far, so references that cannot (on string lengths) are not
+    scored, nor those that cannot reach threshold.  Items stop being scored
+    once their best score reaches short_circuit.  With the default of 100
+    none of this changes any hits - though scores returned for items with
+    no hit may be lower than the true best.
+
+    Optionally pass candidates, a dict of sorted lists of positions in
+    reference_set for each item (eg from gram_index.get_candidates()), to
+    score each item only against those references.
+
+    With n_workers > 1, the distinct items are split across a pool of
+    processes - unless there are fewer than min_parallel_items of them,
+    when starting the pool would cost more than it saves.
+    """
+
+    items = list(items)
+    reference_set = list(reference_set)
+
+    if not items:
+        return []
+
+    if not reference_set:
+        return [(False, 0)] * len(items)
+
+    unique_items = list(dict.fromkeys(items))
+
+    if n_workers > 1 and len(unique_items) >= min_parallel_items:
+        matches = parallel_fuzzy_match(unique_items, reference_set,
+                                       threshold, candidates,
+                                       scorers, short_circuit,
+                                       n_workers, max_cells)
+
+        matches = dict(zip(unique_items, matches))
+
+        return [matches[item] for item in items]
+
+    # best reference position and score so far for each unique item
+    best_refs = np.zeros(len(unique_items), dtype=int)
+    best_scores = np.full(len(unique_items), -1)
+
+    for scorer in scorers:
+
+        # positions of the items still to score
+        to_score = np.nonzero(best_scores < short_circuit)[0]
+
+        if not len(to_score):
+            break
+
+        items_to_score = [unique_items[i] for i in to_score]
+
+        # only a better score can change the hit, and it must reach threshold
+        cutoffs = np.maximum(threshold, best_scores[to_score] + 1)
+
+        if candidates is None:
+            refs, scores = score_against_refs(items_to_score, reference_set,
+                                              scorer, cutoffs, max_cells)
+        else:
+            refs, scores = score_against_candidates(items_to_score,
+                                                    reference_set, candidates,
+                                                    scorer, cutoffs)
+
+        # strictly greater, so the first scorer with the top score wins
+        better = scores > best_scores[to_score]
+        best_refs[to_score[better]] = refs[better]
+        best_scores[to_score[better]] = scores[better]
+
+    matches = {}
+    for item, ref, score in zip(unique_items, best_refs, best_scores):
+
+        if score >= threshold:
+            matches[item] = (reference_set[ref], int(score))
+        else:
+            matches[item] = (False, max(int(score), 0))
+
+    return [matches[item] for item in items]
+
+
+def parallel_fuzzy_match(items, reference_set, threshold=55, candidates=None,
+                         scorers=SCORERS, short_circuit=100,
+                         n_workers=2, max_cells=10**7):
+    """
+    As batch_fuzzy_match(), but splitting items into n_workers chunks,
+    each matched in its own process.  Each process is passed reference_set
+    once, when it starts.
+
+    Returns a list of (hit, score) tuples in the same order as items.
+    """
+
+    chunk_size = -(-len(items) // n_workers)
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+    if candidates is None:
+        chunk_candidates = [None] * len(chunks)
+    else:
+        chunk_candidates = [{x: candidates.get(x, []) for x in chunk}
+                            for chunk in chunks]
+
+    n_chunks = len(chunks)
+
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             initializer=_init_worker,
+                             initargs=(reference_set,)) as pool:
+
+        results = pool.map(_match_chunk, chunks,
+                           [threshold] * n_chunks, chunk_candidates,
+                           [scorers] * n_chunks, [short_circuit] * n_chunks,
+                           [max_cells] * n_chunks)
+
+        # map() returns results in the order of chunks
+        return [match for chunk_result in results for match in chunk_result]
+
+
+# the reference_set in a worker process of parallel_fuzzy_match()
+_worker_reference_set = None
+
+
+def _init_worker(reference_set):
+    global _worker_reference_set
+    _worker_reference_set = reference_set
+
+
+def _match_chunk(items, threshold, candidates, scorers, short_circuit,
+                 max_cells):
+    return batch_fuzzy_match(items, _worker_reference_set, threshold,
+                             candidates=candidates, scorers=scorers,
+                             short_circuit=short_circuit, max_cells=max_cells)
+
+
+def length_bound(len1, len2):
+    """
+    Returns the highest ratio possible for strings of the passed lengths
+    (works on arrays).  Rounded up, so never below the actual ratio.
+
+    Two empty strings are equal, so score 100.
+    """
+
+    total = np.maximum(len1 + len2, 1)
+    bound = np.ceil(100 * 2.0 * np.minimum(len1, len2) / total)
+
+    return np.where(len1 + len2 == 0, 100, bound)
+
+
+def score_against_refs(items, reference_set, scorer, cutoffs=None,
+                       max_cells=10**7):
+    """
+    For a single scorer, returns arrays of the position in reference_set
+    of the best hit for each of items, and its score.
+
+    Ties go to the earliest reference, as with process.extractOne.
+
+    If an array of cutoffs for each item is passed, references that
+    cannot reach an item's cutoff may be skipped (scored as 0).
+    """
+
+    prep = PREPROCESSORS[scorer]
+    score_func = SCORE_FUNCS[scorer]
+
+    # identical processed refs always score the same, so only keep the
+    # first of each (keeping them in order preserves the tie-break)
+    first_positions = {}
+    for pos, ref in enumerate(reference_set):
+        first_positions.setdefault(prep(ref), pos)
+
+    ref_strings = list(first_positions)
+    ref_positions = np.array(list(first_positions.values()))
+
+    item_strings = [prep(item) for item in items]
+
+    prune = cutoffs is not None and scorer in BOUNDED_SCORERS
+    if prune:
+        ref_lens = np.array([len(x) for x in ref_strings])
+        item_lens = np.array([len(x) for x in item_strings])
+
+    best_refs = np.zeros(len(items), dtype=int)
+    best_scores = np.zeros(len(items), dtype=int)
+
+    block = max(1, max_cells // len(ref_strings))
+
+    for start in range(0, len(items), block):
+        stop = start + block
+        block_strings = item_strings[start:stop]
+
+        matrix = np.zeros((len(block_strings), len(ref_strings)),
+                          dtype=np.uint8)
+
+        if prune:
+            to_score = (length_bound(item_lens[start:stop, None], ref_lens)
+                        >= cutoffs[start:stop, None])
+        else:
+            to_score = np.ones(matrix.shape, dtype=bool)
+
+        for row, item in enumerate(block_strings):
+            cols = np.nonzero(to_score[row])[0]
+            matrix[row, cols] = [score_func(item, ref_strings[col])
+                                 for col in cols]
+
+        cols = matrix.argmax(axis=1)
+        best_refs[start:stop] = ref_positions[cols]
+        best_scores[start:stop] = matrix[np.arange(len(matrix)), cols]
+
+    return best_refs, best_scores
+
+
+def score_against_candidates(items, reference_set, candidates, scorer,
+                             cutoffs=None):
+    """
+    As score_against_refs(), but only scoring each item against the
+    positions in reference_set listed for it in candidates.
+
+    Items without candidates get a score of 0.
+    """
+
+    prep = PREPROCESSORS[scorer]
+    score_func = SCORE_FUNCS[scorer]
+    prune = cutoffs is not None and scorer in BOUNDED_SCORERS
+
+    # process each reference once, however many items it is a candidate for
+    ref_strings = {}
+
+    best_refs = np.zeros(len(items), dtype=int)
+    best_scores = np.zeros(len(items), dtype=int)
+
+    for i, item in enumerate(items):
+        item_string = prep(item)
+
+        for pos in candidates.get(item, []):
+            if pos not in ref_strings:
+                ref_strings[pos] = prep(reference_set[pos])
+
+            if (prune and length_bound(len(item_string), len(ref_strings[pos]))
+                              < cutoffs[i]):
+                continue
+
+            score = score_func(item_string, ref_strings[pos])
+
+            # strictly greater, so ties go to the earliest reference
+            if score > best_scores[i]:
+                best_refs[i], best_scores[i] = pos, score
+
+    return best_refs, best_scores
@@ -0,0 +1,75 @@
+# myfin/finance/load_new_txs/canonicalise_items.py
+
+import json
+from pathlib import Path
+
+"""
+Making _item from ITEM - casefolding and stripping, then applying any regex
+rules, so that eg card numbers, dates and store numbers in descriptions do
+not turn one merchant into many _items.
+
+Rules are [pattern, replacement] pairs, applied in order with re.sub
+semantics, eg:
+
+    [["\\\\*+\\\\d{4}", ""],                    card numbers like ****1234
+     ["\\\\d{2}/\\\\d{2}(/\\\\d{2,4})?", ""],        dates like 01/02 or 01/02/19
+     ["\\\\s+#?\\\\d{3,}$", ""]]                 trailing store numbers
+
+Global rules are in the 'item_rules' entry of the project config, and rules
+for an account in item_rules.json in its directory.  Account rules are
+applied after global ones.
+"""
+
+ACC_RULES_FILE_NAME = 'item_rules.json'
+
+
+def load_item_rules(acc_path, config):
+    """
+    Returns the list of rules for the account at acc_path
+    """
+
+    rules = list(config.get('item_rules', []))
+
+    rules_path = Path(acc_path) / ACC_RULES_FILE_NAME
+
+    if rules_path.exists():
+        with rules_path.open() as fp:
+            rules.extend(json.load(fp))
+
+    return rules
+
+
+def canonicalise_items(items, rules=None):
+    """
+    Returns a series of _items for a series of ITEMs.
+
+    Without rules, this is just casefolding and stripping each ITEM.  Rules
+    are applied to the result, after which whitespace is collapsed and
+    stripped again.
+    """
+
+    _items = items.str.casefold().str.strip()
+
+    if not rules:
+        return _items
+
+    for pattern, replacement in rules:
+        _items = _items.str.replace(pattern, replacement, regex=True)
+
+    return _items.str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def count_exact_hits_gained(raw_items, _items, lookups):
+    """
+    Returns the number of rows that are exact hits in one of the lookups
+    (eg from make_lookups()) with the passed _items, but were not with
+    raw_items - ie would otherwise have gone to fuzzy matching
+    """
+
+    def is_exact_hit(x):
+        return any(x in lookup['first'] for lookup in lookups.values())
+
+    raw_hits = raw_items.map(is_exact_hit)
+    hits = _items.map(is_exact_hit)
+
+    return int((hits & ~raw_hits).sum())
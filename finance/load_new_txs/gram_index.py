@@ -0,0 +1,203 @@
+# myfin/finance/load_new_txs/gram_index.py
+
+import json
+import heapq
+import os
+from collections import Counter
+from pathlib import Path
+
+from fuzzywuzzy import utils
+
+from finance.helpers.db_hash import hash_keys
+
+from .batch_fuzzy_match import batch_fuzzy_match
+
+"""
+An inverted index from character n-grams and words to cat_db keys, kept in
+cat_db_index.json next to cat_db.csv.
+
+Used to limit fuzzy matching of an item to the cat_db keys sharing most
+grams with it, rather than every key in cat_db.
+"""
+
+GRAM_SIZE = 3
+INDEX_FILE_NAME = 'cat_db_index.json'
+
+
+def get_grams(string, gram_size=GRAM_SIZE):
+    """
+    Returns the set of words (prefixed 'w:') and character n-grams in
+    string, after the same processing as the fuzzy scorers
+    """
+
+    processed = utils.full_process(string, force_ascii=True)
+
+    grams = set('w:' + word for word in processed.split())
+    grams.update(processed[i:i + gram_size]
+                 for i in range(len(processed) - gram_size + 1))
+
+    return grams
+
+
+def build_gram_index(keys, gram_size=GRAM_SIZE):
+    """
+    Returns an index (a dict) of the passed keys, eg cat_db.index
+    """
+
+    gram_index = {'gram_size': gram_size,
+                  'keys': [],
+                  'keys_hash': None,
+                  'postings': {}}
+
+    return update_gram_index(gram_index, added_keys=keys)
+
+
+def update_gram_index(gram_index, added_keys=(), removed_keys=()):
+    """
+    Adds and removes keys from gram_index, in place.  Also returns it.
+
+    Adding a key already in the index, or removing one that is not, does
+    nothing.
+    """
+
+    postings = gram_index['postings']
+    keys = set(gram_index['keys'])
+
+    removed_keys = set(removed_keys).intersection(keys)
+
+    for key in removed_keys:
+        keys.discard(key)
+        for gram in get_grams(key, gram_index['gram_size']):
+            postings[gram].remove(key)
+            if not postings[gram]:
+                del postings[gram]
+
+    if removed_keys:
+        gram_index['keys'] = [x for x in gram_index['keys']
+                              if x not in removed_keys]
+
+    for key in dict.fromkeys(added_keys):
+        if key in keys:
+            continue
+
+        keys.add(key)
+        gram_index['keys'].append(key)
+        for gram in get_grams(key, gram_index['gram_size']):
+            postings.setdefault(gram, []).append(key)
+
+    gram_index['keys_hash'] = hash_keys(keys)
+
+    return gram_index
+
+
+def load_gram_index(proj_path, cat_db, gram_size=GRAM_SIZE):
+    """
+    Loads the index in proj_path, rebuilding it (and writing it out) if
+    it is missing, cannot be read, or does not match the keys of the
+    passed cat_db
+    """
+
+    index_path = Path(proj_path) / INDEX_FILE_NAME
+
+    if index_path.exists():
+        try:
+            with index_path.open() as fp:
+                gram_index = json.load(fp)
+
+            if (gram_index['gram_size'] == gram_size
+                  and gram_index['keys_hash'] == hash_keys(cat_db.index)):
+                return gram_index
+
+            print('cat_db has changed since', INDEX_FILE_NAME,
+                  'was written - rebuilding it')
+
+        except (ValueError, KeyError, TypeError):
+            print('could not read', index_path, '- rebuilding it')
+
+    gram_index = build_gram_index(cat_db.index, gram_size)
+    save_gram_index(gram_index, proj_path)
+
+    return gram_index
+
+
+def save_gram_index(gram_index, proj_path):
+    """
+    Writes gram_index to proj_path, via a temp file so a run loading it at
+    the same time never reads a part written file
+    """
+
+    index_path = Path(proj_path) / INDEX_FILE_NAME
+    temp_path = index_path.with_name(f'{index_path.name}.{os.getpid()}.tmp')
+
+    with temp_path.open('w') as fp:
+        json.dump(gram_index, fp)
+
+    temp_path.replace(index_path)
+
+
+def get_candidates(items, reference_set, gram_index,
+                   top_n=50, min_shared=1):
+    """
+    Returns a dict with, for each item, a sorted list of positions in
+    reference_set of the (up to) top_n keys sharing most grams with it -
+    and at least min_shared.
+
+    Keys not in reference_set are ignored.
+    """
+
+    # first position of each key, as that is the one a full scan returns
+    positions = {}
+    for pos, key in enumerate(reference_set):
+        positions.setdefault(key, pos)
+
+    candidates = {}
+
+    for item in dict.fromkeys(items):
+
+        counts = Counter()
+        for gram in get_grams(item, gram_index['gram_size']):
+            counts.update(gram_index['postings'].get(gram, ()))
+
+        shared = [key for key in counts
+                  if counts[key] >= min_shared and key in positions]
+
+        top_keys = heapq.nlargest(top_n, shared, key=counts.get)
+        candidates[item] = sorted(positions[key] for key in top_keys)
+
+    return candidates
+
+
+def check_gram_index_recall(items, reference_set, gram_index,
+                            top_n=50, min_shared=1, **match_kwargs):
+    """
+    Compares fuzzy hits for items using candidates from gram_index with
+    hits from a full scan of reference_set.
+
+    Returns a dict with the number of items checked, the number with the
+    same hit, the recall (proportion the same) and a list of misses, as
+    (item, full scan hit, pruned hit) tuples.
+
+    Any match_kwargs (eg threshold, scorers) are passed to batch_fuzzy_match()
+    """
+
+    items = list(dict.fromkeys(items))
+    reference_set = list(reference_set)
+
+    candidates = get_candidates(items, reference_set, gram_index,
+                                top_n=top_n, min_shared=min_shared)
+
+    full_hits = batch_fuzzy_match(items, reference_set, **match_kwargs)
+    pruned_hits = batch_fuzzy_match(items, reference_set,
+                                    candidates=candidates, **match_kwargs)
+
+    misses = [(item, full[0], pruned[0])
+              for item, full, pruned in zip(items, full_hits, pruned_hits)
+              if full[0] != pruned[0]]
+
+    n_same = len(items) - len(misses)
+
+    return {'n_items': len(items),
+            'n_same': n_same,
+            'recall': n_same / len(items) if items else 1.0,
+            'misses': misses}
+
@@ -0,0 +1,175 @@
+# myfin/finance/load_new_txs/load_all_accounts.py
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from shutil import rmtree
+
+from mylogger import get_filelog
+
+from finance.helpers.load_dbs_from_disk import (load_dbs_from_disk,
+                                                 get_dbs_signature)
+from finance.helpers.load_config import load_config
+from finance.helpers.project_lock import project_lock
+
+from .append_to_dbs import ensure_tidy_dbs
+from .canonicalise_items import load_item_rules
+from .load_new_txs import (load_matchers, get_files_to_process,
+                           read_new_txs, categorise_chunks, append_file,
+                           get_staging_path, retrim_df, commit_new_dbs,
+                           tidy_account_files)
+from .make_lookups import make_lookups
+from .match_cache import save_match_cache, store_matches
+from .target_rules import load_target_rules
+from .tx_fingerprints import add_fingerprints, make_fingerprint_index
+
+"""
+Loading the new txs of every account in tx_accounts/ at once.
+
+Each account's files are read, cleaned and categorised against the dbs on
+disk in a worker process (prepare_account()).  The results are then
+appended to the dbs in account and file name order, so ids are the same
+whatever order the workers finish in, and the dbs are written and
+archived once.
+
+Txs a worker found no exact hit for are looked up again as they are
+appended, in case an earlier account or file added their _items to
+fuzzy_db or unknowns_db - so the dbs are as if load_new_txs() had been
+run for each account in turn.
+"""
+
+
+def load_all_accounts(proj_path=None, return_dbs=False, write_out_dbs=True,
+                      move_new_txs=True, delete_temp_csvs=True):
+    """
+    Loads new txs for all accounts in the tx_accounts dir of proj_path,
+    preparing them in the project config's 'load_workers' processes
+    """
+
+    if proj_path is None:
+        proj_path = Path()
+
+    main_dir = Path(proj_path).absolute()
+    logger = get_filelog(main_dir / 'log.txt')
+    logger.info('*'*6 + 'calling load_all_accounts()' + '*'*6)
+
+    config = load_config(main_dir)
+
+    acc_paths = sorted(x for x in (main_dir / 'tx_accounts').iterdir()
+                       if x.is_dir() and not x.name.startswith('.'))
+
+    # to see if another run writes the dbs while this one works on them
+    disk_signature = get_dbs_signature(main_dir, config['storage'])
+    dbs = ensure_tidy_dbs(load_dbs_from_disk(main_dir, config['storage']))
+
+    n_old_txs = len(dbs['tx_db'])
+    lookups = make_lookups(dbs)
+
+    dbs['tx_db'] = add_fingerprints(dbs['tx_db'])
+    fingerprint_index = make_fingerprint_index(dbs['tx_db'])
+
+    # any gram index or tfidf model is built here, so the workers all load
+    # it rather than each writing it.  The workers' fuzzy matches are added
+    # to the match cache, and it is saved once.
+    _, _, match_cache = load_matchers(main_dir, dbs, config, logger)
+
+    new_files = []
+    loaded_acc_paths = []
+    staging_path = get_staging_path(main_dir, config)
+
+    with ProcessPoolExecutor(max_workers=config['load_workers']) as executor:
+
+        # results come in the order of acc_paths
+        prepared = executor.map(prepare_account, acc_paths,
+                                [config] * len(acc_paths))
+
+        for acc_path, result in zip(acc_paths, prepared):
+            logger.info('-'*6 + f'appending {acc_path.name}' + '-'*6)
+
+            if result['files']:
+                loaded_acc_paths.append(acc_path)
+
+            for name, dfs in result['files']:
+                n_file_old_txs = len(dbs['tx_db'])
+                dfs = (retrim_df(df, dbs['tx_db'], fingerprint_index)
+                       for df in dfs)
+                dbs = append_file(dfs, acc_path.name, dbs, lookups,
+                                  fingerprint_index, relookup=True,
+                                  staging_path=staging_path,
+                                  storage=config['storage'])
+                new_files.append((acc_path.name, n_file_old_txs,
+                                  len(dbs['tx_db'])))
+
+            if match_cache is not None:
+                store_matches(match_cache, result['new_matches'])
+
+    logger.info(f'--> Total new txs: {len(dbs["tx_db"]) - n_old_txs}')
+
+    if write_out_dbs:
+        dbs = commit_new_dbs(dbs, new_files, n_old_txs, disk_signature,
+                             main_dir, config, 'loaded_all_accounts', logger,
+                             match_cache=match_cache,
+                             staging_path=staging_path)
+    else:
+        logger.info('not writing out')
+
+        if staging_path is not None:
+            rmtree(staging_path)
+
+        if match_cache is not None:
+            with project_lock(main_dir, config['lock_timeout']):
+                save_match_cache(match_cache, main_dir)
+
+    for acc_path in loaded_acc_paths:
+        tidy_account_files(acc_path, move_new_txs, delete_temp_csvs, logger)
+
+    if return_dbs:
+        return dbs
+
+
+def prepare_account(acc_path, config):
+    """
+    Reads, cleans and categorises the new txs of the account at acc_path,
+    against the dbs on disk.  Returns a dict of the txs, as a list of
+    (file or batch name, list of dfs) - one df per chunk read - and of the
+    fuzzy matches made, for the match cache.
+    """
+
+    main_dir = acc_path.parents[1]
+    logger = get_filelog(main_dir / 'log.txt')
+    logger.info('*'*6 + 'preparing ' + acc_path.name + '*'*6)
+
+    dbs = load_dbs_from_disk(main_dir, config['storage'])
+    lookups = make_lookups(dbs)
+
+    dbs['tx_db'] = add_fingerprints(dbs['tx_db'])
+    fingerprint_index = make_fingerprint_index(dbs['tx_db'])
+
+    item_rules = load_item_rules(acc_path, config)
+    target_rules = load_target_rules(acc_path, config)
+
+    gram_index, tfidf_model, match_cache = load_matchers(main_dir, dbs,
+                                                         config, logger)
+    cached = set() if match_cache is None else set(match_cache['entries'])
+
+    files = []
+    for name, dfs in read_new_txs(get_files_to_process(acc_path, logger),
+                                  acc_path, item_rules, lookups, config,
+                                  logger):
+        logger.info('-'*6 + f'processing {name}' + '-'*6)
+
+        files.append((name, list(categorise_chunks(
+                                    dfs, acc_path.name, dbs, lookups,
+                                    fingerprint_index,
+                                    target_rules=target_rules,
+                                    gram_index=gram_index,
+                                    match_cache=match_cache,
+                                    tfidf_model=tfidf_model, config=config,
+                                    logger=logger))))
+
+    new_matches = {}
+    if match_cache is not None:
+        new_matches = {x: hit for x, hit in match_cache['entries'].items()
+                       if x not in cached}
+
+    return {'files': files, 'new_matches': new_matches}
+
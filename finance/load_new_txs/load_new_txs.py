@@ -4,21 +4,39 @@ import pandas as pd
 import numpy as np
 from shutil import move
 from pathlib import Path
+from shutil import rmtree
 import json
 import subprocess
 
 from mylogger import get_filelog
 
 # imports from other project directories / modules
-from finance.helpers.load_dbs_from_disk import load_dbs_from_disk
+from finance.helpers.load_dbs_from_disk import (load_dbs_from_disk,
+                                                 get_dbs_signature)
+from finance.helpers.project_lock import project_lock
+from finance.helpers.load_config import load_config
+from finance.helpers.db_storage import (write_dbs, db_path, append_tx_db,
+                                        compact_tx_db, make_staging_path,
+                                        stage_segment, publish_segments)
 
 # imports from this directory
 from .apply_parser import apply_parser
 from .trim_df import trim_df
+from .tx_fingerprints import (get_fingerprints, get_numbers, get_check_cols,
+                              get_check_keys, add_fingerprints,
+                              make_fingerprint_index,
+                              update_fingerprint_index)
 from .clean_tx_df import clean_tx_df
-from .add_target_acc_col import add_target_acc_col
-from .append_to_dbs import append_to_all_dbs
+from .add_target_acc_col import add_target_acc_col, assign_targets
+from .append_to_dbs import append_to_all_dbs, ensure_tidy_dbs
 from .archive_dbs import archive_dbs
+from .gram_index import load_gram_index, check_gram_index_recall
+from .match_cache import get_cache_version, load_match_cache, save_match_cache
+from .make_lookups import make_lookups, update_lookup
+from .tfidf_match import load_tfidf_model
+from .target_rules import load_target_rules
+from .canonicalise_items import (load_item_rules, canonicalise_items,
+                                 count_exact_hits_gained)
 
 
 
@@ -49,7 +67,120 @@ def load_new_txs(acc_path,
     logger = get_filelog(main_dir / 'log.txt')
     logger.info('*'*6 + 'calling load_new_txs() for ' + acc_path.name + '*' *6)
 
-    dbs = load_dbs_from_disk(main_dir)
+    config = load_config(main_dir)
+
+    # to see if another run writes the dbs while this one works on them
+    disk_signature = get_dbs_signature(main_dir, config['storage'])
+    dbs = ensure_tidy_dbs(load_dbs_from_disk(main_dir, config['storage']))
+
+    # rows of tx_db before loading - any after are new
+    n_old_txs = len(dbs['tx_db'])
+
+    # dict lookups of cat_db etc, and the fingerprints of the txs (only
+    # indexed for the dates of new txs, as they are trimmed), kept up to
+    # date as dbs are appended to
+    lookups = make_lookups(dbs)
+
+    dbs['tx_db'] = add_fingerprints(dbs['tx_db'])
+    fingerprint_index = make_fingerprint_index(dbs['tx_db'])
+
+    item_rules = load_item_rules(acc_path, config)
+    target_rules = load_target_rules(acc_path, config)
+
+    gram_index, tfidf_model, match_cache = load_matchers(main_dir, dbs,
+                                                         config, logger)
+
+    files_to_process = get_files_to_process(acc_path, logger)
+
+    if not files_to_process:
+        print('no new files found')
+        return
+
+    
+    # with tx_db segments, each chunk's new txs are written out as they
+    # are appended, and added to tx_db when committing
+    staging_path = get_staging_path(main_dir, config)
+
+    # MAIN LOOP: build df of new txs; append txs to dbs as required
+    new_files = []
+    for name, dfs in read_new_txs(files_to_process, acc_path, item_rules,
+                                  lookups, config, logger):
+        logger.info('-'*6 + f'processing {name}' + '-'*6)
+
+        # TODO standardise column types etc
+        dfs = categorise_chunks(dfs, acc_path.name, dbs, lookups,
+                                fingerprint_index, target_rules=target_rules,
+                                gram_index=gram_index,
+                                match_cache=match_cache,
+                                tfidf_model=tfidf_model, config=config,
+                                logger=logger)
+
+        n_file_old_txs = len(dbs['tx_db'])
+        dbs = append_file(dfs, acc_path.name, dbs, lookups,
+                          fingerprint_index, staging_path=staging_path,
+                          storage=config['storage'])
+        new_files.append((acc_path.name, n_file_old_txs, len(dbs['tx_db'])))
+        logger.info(f'appended to dbs')
+
+    logger.info(f'--> Total new txs for {acc_path.name}: '
+                f'{len(dbs["tx_db"]) - n_old_txs}')
+
+    if match_cache is not None:
+        logger.info(f'match cache: {match_cache["hits"]} hits, '
+                    f'{match_cache["misses"]} misses')
+
+    # CLEANING UP
+    if write_out_dbs:
+        dbs = commit_new_dbs(dbs, new_files, n_old_txs, disk_signature,
+                             main_dir, config, 'loaded_' + acc_path.name,
+                             logger, match_cache=match_cache,
+                             staging_path=staging_path)
+    else:
+        logger.info(f'not writing out')
+
+        if staging_path is not None:
+            rmtree(staging_path)
+
+        if match_cache is not None:
+            with project_lock(main_dir, config['lock_timeout']):
+                save_match_cache(match_cache, main_dir)
+
+    tidy_account_files(acc_path, move_new_txs, delete_temp_csvs, logger)
+
+    if return_dbs:
+        return(dbs)
+
+
+def load_matchers(main_dir, dbs, config, logger):
+    """
+    Returns the gram_index, tfidf_model and match_cache of cat_db to use
+    for fuzzy matching, as set in config (each None if not used)
+    """
+
+    gram_index = None
+    if config['gram_index']:
+        gram_index = load_gram_index(main_dir, dbs['cat_db'])
+        logger.info('loaded cat_db gram index')
+
+    tfidf_model = None
+    if config['match_engine'] == 'tfidf':
+        tfidf_model = load_tfidf_model(main_dir, dbs['cat_db'])
+        logger.info('loaded cat_db tfidf model')
+
+    match_cache = None
+    if config['match_cache']:
+        match_cache = load_match_cache(main_dir,
+                                       get_cache_version(dbs['cat_db'], config),
+                                       max_size=config['match_cache_size'])
+
+    return gram_index, tfidf_model, match_cache
+
+
+def get_files_to_process(acc_path, logger):
+    """
+    Returns the paths of the csvs to load for the account at acc_path, in
+    name order, after running any prep.py on its pre-csv input files
+    """
 
     # run any prep.py to process pre-csv input files
     if ((acc_path / 'prep.py').exists() and
@@ -59,91 +190,387 @@ def load_new_txs(acc_path,
         logger.info('processed pre_csvs')
 
     # get files ready for loading
-    if (acc_path / 'new_csvs').exists():
-        new_csv_paths = list((acc_path / 'new_csvs').iterdir())
-        if new_csv_paths:
-            files_to_process = new_csv_paths
-            logger.info(f'found {len(new_csv_paths)} files in new_csvs')
-        else:
-            logger.info(f'found no new csvs to process')
-
-    elif (acc_path / 'temp_csvs').exists():
-        temp_csv_paths = list((acc_path / 'temp_csvs').iterdir())
-        if temp_csv_paths:
-            files_to_process = temp_csv_paths
-            logger.info(f'found {len(temp_csv_paths)} files in temp_csvs')
-        else:
-            logger.info(f'found no new csvs to process')
+    for dir_name in ['new_csvs', 'temp_csvs']:
+        if (acc_path / dir_name).exists():
+            csv_paths = sorted((acc_path / dir_name).iterdir())
+            logger.info(f'found {len(csv_paths)} files in {dir_name}')
+            return csv_paths
 
-    else:
-        print('no new files found')
-        logger.info(f'found no new csvs to process')
-        return
+    logger.info(f'found no new csvs to process')
+    return []
 
-    
-    # MAIN LOOP: build df of new txs; append txs to dbs as required
-    new_tx_count = 0
-    for csv_file in files_to_process:
-        logger.info('-'*6 + f'processing {csv_file.name}' + '-'*6)
 
-        df = pd.read_csv(csv_file)
-        logger.info(f'loaded csv with {len(df)} txs')
+def prepare_tx_df(df, acc_path, item_rules, lookups, logger):
+    """
+    Returns df of txs read from a csv for the account at acc_path, parsed
+    and cleaned, with accX and _item columns
+    """
+
+    if (acc_path / 'parser.json').exists():
+        df = apply_parser(df, acc_path)
 
-        if (acc_path / 'parser.json').exists():
-            df = apply_parser(df, acc_path)
+    df = clean_tx_df(df)
 
-        df = clean_tx_df(df)
+    if not 'net_amt' in df.columns:
+        df['net_amt'] = (df['credit_amt']
+                             .subtract(df['debit_amt'], fill_value=0))
+        logger.info(f'made net_amts')
 
-        if not 'net_amt' in df.columns:
-            df['net_amt'] = (df['credit_amt']
-                                 .subtract(df['debit_amt'], fill_value=0))
-            logger.info(f'made net_amts')
+    df['accX'] = acc_path.name
+    df['_item'] = canonicalise_items(df['ITEM'], item_rules)
 
-        df['accX'] = acc_path.name
-        df['_item'] = df['ITEM'].apply(lambda x: x.casefold().strip())
+    if item_rules:
+        gained = count_exact_hits_gained(canonicalise_items(df['ITEM']),
+                                         df['_item'], lookups)
+        logger.info(f'item rules moved {gained} txs from fuzzy matching'
+                    ' to exact hits')
 
-        df = trim_df(df, dbs['tx_db'])
+    return df
+
+
+def categorise_tx_df(df, acc_name, dbs, lookups, target_rules=None,
+                     gram_index=None, match_cache=None, tfidf_model=None,
+                     config=None, logger=None):
+    """
+    Adds the accY and mode columns to df (see add_target_acc_col()), and
+    logs a check of the gram index recall if one is used
+    """
+
+    df = add_target_acc_col(df, acc_name, dbs, lookups=lookups,
+                            target_rules=target_rules,
+                            gram_index=gram_index,
+                            match_cache=match_cache,
+                            tfidf_model=tfidf_model, config=config)
+
+    # check a sample of fuzzy matched items gets the same hits without
+    # the gram index
+    if gram_index is not None and config['gram_index_recall_sample']:
+        fuzzied = (df.loc[df['mode'].isin(['fuzzy match', 'new unknown']),
+                          '_item'].drop_duplicates())
+        sample = fuzzied.sample(min(len(fuzzied),
+                                    config['gram_index_recall_sample']),
+                                random_state=0)
+
+        recall = check_gram_index_recall(
+                    sample, dbs['cat_db'].index.values, gram_index,
+                    top_n=config['gram_index_top_n'],
+                    min_shared=config['gram_index_min_shared'],
+                    threshold=config['fuzzy_threshold'],
+                    scorers=config['fuzzy_scorers'],
+                    short_circuit=config['fuzzy_short_circuit'])
+
+        logger.info(f'gram index recall: {recall["n_same"]} of '
+                    f'{recall["n_items"]} sampled hits same as full scan')
+
+        if recall['misses']:
+            print('WARNING: gram index gave different fuzzy hits for',
+                  recall['misses'], "- try raising 'gram_index_top_n'")
+
+    return df
+
+
+def categorise_chunks(dfs, acc_name, dbs, lookups, fingerprint_index,
+                      target_rules=None, gram_index=None, match_cache=None,
+                      tfidf_model=None, config=None, logger=None):
+    """
+    Yields the chunks in dfs, of a file of txs of acc_name, trimmed of txs
+    in fingerprint_index and categorised with categorise_tx_df()
+    """
+
+    for df in dfs:
+        df = trim_df(df, dbs['tx_db'], fingerprint_index=fingerprint_index)
         logger.info(f'after trim_df, {len(df)} txs')
 
-        df = add_target_acc_col(df, acc_path.name, dbs)
+        yield categorise_tx_df(df, acc_name, dbs, lookups,
+                               target_rules=target_rules,
+                               gram_index=gram_index,
+                               match_cache=match_cache,
+                               tfidf_model=tfidf_model, config=config,
+                               logger=logger)
 
-        # TODO standardise column types etc
 
+def append_file(dfs, acc_name, dbs, lookups, fingerprint_index,
+                relookup=False, staging_path=None, storage='csv'):
+    """
+    Appends dfs, the trimmed and categorised chunks of a file of txs of
+    acc_name, to dbs - first looking up their targets again with relookup
+    (see relookup_targets()).  If a staging_path is passed, each chunk's
+    new tx_db rows are staged there as a segment in storage format.
+    Returns dbs.
+
+    lookups and fingerprint_index are only updated with the file's txs
+    after all its chunks, so if dfs trims and categorises the chunks as
+    they are taken, they all get the same results as the whole file would.
+    """
+
+    n_file_old_txs = len(dbs['tx_db'])
+    new_fuzzies = []
+    new_unknowns = []
+
+    for df in dfs:
+        if relookup:
+            df = relookup_targets(df, acc_name, lookups)
+
+        n_chunk_old_txs = len(dbs['tx_db'])
         dbs = append_to_all_dbs(df, dbs)
-        logger.info(f'appended to dbs')
 
-        new_tx_count += len(df)
+        if staging_path is not None and len(df):
+            stage_segment(dbs['tx_db'].iloc[n_chunk_old_txs:], staging_path,
+                          storage)
 
-    logger.info(f'--> Total new txs for {acc_path.name}: {new_tx_count}')
+        new_fuzzies += list(df.loc[df['mode'] == 'fuzzy match', '_item'])
+        new_unknowns += list(df.loc[df['mode'] == 'new unknown', '_item'])
 
-    # CLEANING UP
-    if write_out_dbs:
-        for db in dbs:
-            dbs[db].to_csv(main_dir / (db + '.csv'))
-            logger.info(f'writing out to {main_dir / (db + ".csv")}')
+    update_lookup(lookups['fuzzy_db'], dbs['fuzzy_db'], new_fuzzies)
+    update_lookup(lookups['unknowns_db'], dbs['unknowns_db'], new_unknowns)
+    update_fingerprint_index(fingerprint_index,
+                             dbs['tx_db'].iloc[n_file_old_txs:])
+
+    return dbs
+
+
+def get_staging_path(main_dir, config):
+    """
+    Returns a new dir to stage new tx_db segments in while loading, if
+    config has 'tx_db_segments' and they are kept in files, or else None
+    """
+
+    if (config['tx_db_segments'] and config['tx_db_partition_by'] is None
+          and config['storage'] != 'sqlite'):
+        return make_staging_path(main_dir)
+
+    return None
+
+
+def commit_new_dbs(dbs, new_files, n_old_txs, disk_signature, main_dir,
+                   config, annotation, logger, match_cache=None,
+                   staging_path=None):
+    """
+    Writes out dbs with the new txs appended (those after n_old_txs in
+    tx_db, with any segments of them in staging_path), and archives them
+    with annotation, and saves any match_cache.
+
+    new_files are the (account name, start, end) rows of tx_db of each
+    file loaded.  If the dbs on disk no longer have disk_signature, the new
+    txs are appended to those instead, as if loaded after them.  Returns
+    the dbs written.
+    """
+
+    with project_lock(main_dir, config['lock_timeout']):
+
+        # if another run has written the dbs since they were loaded,
+        # add the new txs to its dbs instead
+        if get_dbs_signature(main_dir, config['storage']) != disk_signature:
+            logger.info('dbs changed on disk since loading - merging')
 
-        archive_dbs(proj_path=main_dir, annotation='loaded_' + acc_path.name)
+            # the merged txs are written instead of any staged
+            if staging_path is not None:
+                rmtree(staging_path)
+                staging_path = None
+
+            new_txs = dbs['tx_db']
+            dbs = ensure_tidy_dbs(load_dbs_from_disk(main_dir,
+                                                     config['storage']))
+            dbs['tx_db'] = add_fingerprints(dbs['tx_db'])
+            n_old_txs = len(dbs['tx_db'])
+
+            # trimmed and looked up again, a file at a time as when loaded
+            lookups = make_lookups(dbs)
+            fingerprint_index = make_fingerprint_index(dbs['tx_db'])
+
+            for acc_name, start, end in new_files:
+                df = retrim_df(new_txs.iloc[start:end], dbs['tx_db'],
+                               fingerprint_index)
+                dbs = append_file([df], acc_name, dbs, lookups,
+                                  fingerprint_index, relookup=True)
+
+        write_new_dbs(dbs, n_old_txs, main_dir, config, logger, staging_path)
+
+        if match_cache is not None:
+            save_match_cache(match_cache, main_dir)
+
+        archive_dbs(proj_path=main_dir, annotation=annotation,
+                    storage=config['storage'])
         logger.info(f'archived dbs')
 
-    else:
-        logger.info(f'not writing out')
+    return dbs
+
+
+def retrim_df(df, tx_db, fingerprint_index=None):
+    """
+    trim_df() for a df of txs already trimmed and categorised (so indexed
+    by date), against a later tx_db.  Their accY and mode are kept, and
+    ids given again on appending.
+    """
+
+    df = df.drop(columns='id', errors='ignore').reset_index()
+
+    return trim_df(df, tx_db, fingerprint_index=fingerprint_index)
+
+
+def relookup_targets(df, acc_name, lookups):
+    """
+    Looks up the _items of the txs in df that were fuzzy matched or new
+    unknowns again, in lookups kept up to date with the txs appended
+    before them, and takes any hits
+    """
+
+    to_check = np.flatnonzero(df['mode'].isin(['fuzzy match',
+                                               'new unknown']).values)
+
+    results = assign_targets(df['_item'].values[to_check], acc_name,
+                             lookups=lookups, fuzzymatch=False)
+
+    accYs = df['accY'].values.copy()
+    modes = df['mode'].values.copy()
+
+    for i, (accY, mode) in zip(to_check, results):
+        if mode != 'new unknown':
+            accYs[i] = accY
+            modes[i] = mode
+
+    df['accY'] = accYs
+    df['mode'] = modes
+
+    return df
+
+
+def tidy_account_files(acc_path, move_new_txs=True, delete_temp_csvs=True,
+                       logger=None):
+    """
+    Moves the loaded input files of the account at acc_path to
+    old_originals, and deletes any temp_csvs
+    """
 
     if move_new_txs:
 
-        for file in (acc_path / 'new_csvs').iterdir():
-            move(file, acc_path / 'old_originals' / file.name)
-            logger.info(f'moved {file} to',
-                        '{acc_path / "old_originals" / file.name}')
+        for dir_name in ['new_csvs', 'new_pre_csvs']:
+            if not (acc_path / dir_name).exists():
+                continue
 
-        for file in (acc_path / 'new_pre_csvs').iterdir():
-            move(file, acc_path / 'old_originals' / file.name)
+            for file in (acc_path / dir_name).iterdir():
+                move(file, acc_path / 'old_originals' / file.name)
+                logger.info(f'moved {file} to '
+                            f'{acc_path / "old_originals" / file.name}')
 
     if delete_temp_csvs and (acc_path / 'temp_csvs').exists():
 
         for file in (acc_path / 'temp_csvs').iterdir():
             file.unlink()
 
-    if return_dbs:
-        return(dbs)
+
+def read_new_txs(csv_files, acc_path, item_rules, lookups, config, logger):
+    """
+    Yields (name, dfs) for each of csv_files, where dfs yields its txs,
+    prepared with prepare_tx_df(), in chunks of the config's
+    'stream_chunk_size' rows.  Each tx's source is its file name.
+
+    With the config's 'batch_files', yields all the files as one batch
+    instead - so they are loaded as if they were one file - less the txs
+    of each already in an earlier one (see drop_batch_dups()).
+    """
+
+    def read_file(csv_file):
+        for df in read_csv_chunks(csv_file, config['stream_chunk_size']):
+            logger.info(f'loaded {csv_file.name} with {len(df)} txs')
+
+            if not 'source' in df.columns:
+                df['source'] = csv_file.name
+
+            yield prepare_tx_df(df, acc_path, item_rules, lookups, logger)
+
+    if not config['batch_files']:
+        for csv_file in csv_files:
+            yield csv_file.name, read_file(csv_file)
+        return
+
+    if csv_files:
+        batch = drop_batch_dups([pd.concat(list(read_file(x)),
+                                           ignore_index=True)
+                                 for x in csv_files])
+        logger.info(f'batched {len(csv_files)} files, with {len(batch)} '
+                    'txs not in an earlier file')
+
+        yield f'batch of {len(csv_files)} files', [batch]
+
+
+def drop_batch_dups(dfs):
+    """
+    Returns dfs concatenated, less the txs of each found in an earlier df
+    as trim_df() finds them (by fingerprint, and the CHECK_COLS the df
+    has).  Repeats within a df are kept, as they are by trim_df().
+    """
+
+    kept = []
+
+    for df in dfs:
+        checks = get_check_cols(df)
+        fingerprints = get_fingerprints(df)
+        keys = get_check_keys(fingerprints,
+                              {col: get_numbers(df, col) for col in checks})
+
+        if kept:
+            earlier = pd.concat(kept, ignore_index=True)
+            seen = get_check_keys(get_fingerprints(earlier),
+                                  {col: get_numbers(earlier, col)
+                                   for col in checks})
+            df = df[~np.isin(keys, seen)]
+
+        kept.append(df)
+
+    return pd.concat(kept, ignore_index=True)
+
+
+def read_csv_chunks(csv_file, chunk_size=None):
+    """
+    Yields the txs in csv_file as dfs of up to chunk_size rows, or all in
+    one df if chunk_size is None
+    """
+
+    if chunk_size is None:
+        yield pd.read_csv(csv_file)
+        return
+
+    with pd.read_csv(csv_file, chunksize=chunk_size) as reader:
+        yield from reader
+
+
+def write_new_dbs(dbs, n_old_txs, main_dir, config, logger,
+                  staging_path=None):
+    """
+    Writes out dbs after loading new txs (those after n_old_txs in tx_db),
+    in the storage set in config - adding the segments in any staging_path
+    to tx_db rather than writing its new rows again
+    """
+
+    dbs_to_write = dict(dbs)
+
+    # only write the new rows of tx_db, as a segment or to the partitions
+    # they fall in
+    partition_by = config['tx_db_partition_by']
+    n_segments = 0
+
+    if staging_path is not None:
+        dbs_to_write.pop('tx_db')
+        n_segments = publish_segments(staging_path, main_dir,
+                                      config['storage'], tx_db=dbs['tx_db'])
+        logger.info(f'appended {len(dbs["tx_db"]) - n_old_txs} txs to '
+                    f'tx_db, with {n_segments} segments')
+
+    elif config['tx_db_segments'] or partition_by is not None:
+        n_segments = append_tx_db(dbs_to_write.pop('tx_db').iloc[n_old_txs:],
+                                  main_dir, config['storage'], partition_by,
+                                  tx_db=dbs['tx_db'])
+        logger.info(f'appended {len(dbs["tx_db"]) - n_old_txs} txs to '
+                    f'tx_db, with {n_segments} segments')
+
+    # staged or not, merge the segments once there are enough of them
+    if n_segments and n_segments >= config['tx_db_compact_after']:
+        compact_tx_db(main_dir, config['storage'])
+        logger.info(f'compacted {n_segments} tx_db segments')
+
+    write_dbs(dbs_to_write, main_dir, config['storage'])
+    for db in dbs_to_write:
+        logger.info(f'writing out to {db_path(main_dir, db, config["storage"])}')
     
 
@@ -0,0 +1,83 @@
+# myfin/finance/load_new_txs/make_lookups.py
+
+"""
+Dict lookups of the cat_db, fuzzy_db and unknowns_db, for assign_targets()
+to resolve exact hits without making a df for every item.
+
+A lookup is partitioned by accX:
+
+    {'by_acc': {accX: {_item: accY}},
+     'first': {_item: accY}}
+
+keeping the first accY for each _item in each account's partition, and in
+'first' the accY of the first row for each _item, across all accounts.  So
+an _item is looked up in the home account's partition, falling back to
+'first' - the same preference as pick_match().
+"""
+
+LOOKUP_DBS = ['cat_db', 'fuzzy_db', 'unknowns_db']
+
+
+def make_lookups(dbs):
+    """
+    Returns a dict of lookups for each of LOOKUP_DBS in dbs
+    """
+
+    return {db: make_lookup(dbs[db]) for db in LOOKUP_DBS
+            if dbs.get(db) is not None}
+
+
+def make_lookup(db):
+    """
+    Returns a lookup for db, which is indexed by _item
+    """
+
+    lookup = {'by_acc': {}, 'first': {}}
+
+    for _item, accX, accY in zip(db.index, db['accX'], db['accY']):
+        lookup['by_acc'].setdefault(accX, {}).setdefault(_item, accY)
+        lookup['first'].setdefault(_item, accY)
+
+    return lookup
+
+
+def update_lookup(lookup, db, _items):
+    """
+    Remakes the entries in lookup for the passed _items, from db
+    (eg after appending rows for them).  Updates in place.
+    """
+
+    _items = set(_items)
+
+    for _item in _items:
+        lookup['first'].pop(_item, None)
+
+    for accX in list(lookup['by_acc']):
+        partition = lookup['by_acc'][accX]
+
+        for _item in _items:
+            partition.pop(_item, None)
+
+        if not partition:
+            del lookup['by_acc'][accX]
+
+    new_entries = make_lookup(db.loc[db.index.isin(_items)])
+
+    for accX, partition in new_entries['by_acc'].items():
+        lookup['by_acc'].setdefault(accX, {}).update(partition)
+
+    lookup['first'].update(new_entries['first'])
+
+
+def pick_from_lookup(lookup, _item, account):
+    """
+    Returns the accY for _item from lookup, preferring the one for account
+    and otherwise the first - as pick_match() does for a df of hits
+    """
+
+    home = lookup['by_acc'].get(account, {})
+
+    if _item in home:
+        return home[_item]
+
+    return lookup['first'][_item]
@@ -0,0 +1,135 @@
+# myfin/finance/load_new_txs/match_cache.py
+
+import json
+import os
+from collections import OrderedDict
+from hashlib import sha1
+from pathlib import Path
+
+from finance.helpers.db_hash import hash_db
+
+"""
+An on-disk cache of fuzzy match results, kept in match_cache.json in the
+project dir.
+
+Entries are (hit, score) tuples keyed by _item, kept in least recently
+used order and bounded in number.  The cache has a version, from the
+cat_db and the matching settings, and is emptied if loaded with a
+different one, or if it cannot be read.
+
+It is written to a temp file then renamed, so another run loading it at
+the same time never reads a part written file.
+"""
+
+CACHE_FILE_NAME = 'match_cache.json'
+
+# config entries that can change fuzzy match results
+MATCH_SETTINGS = ['match_engine', 'fuzzy_scorers', 'fuzzy_threshold', 'fuzzy_short_circuit',
+                  'fuzzy_account_first',
+                  'gram_index', 'gram_index_top_n', 'gram_index_min_shared']
+
+
+def get_cache_version(cat_db, config):
+    """
+    Returns a version string for a cache of matches against cat_db made
+    with the passed config
+    """
+
+    settings = {x: config[x] for x in MATCH_SETTINGS}
+
+    version = sha1(hash_db(cat_db).encode())
+    version.update(json.dumps(settings, sort_keys=True).encode())
+
+    return version.hexdigest()
+
+
+def load_match_cache(proj_path, version, max_size=10000):
+    """
+    Returns the cache in proj_path, or an empty one if there is none, it
+    has a different version, or it cannot be read
+    """
+
+    cache = {'version': version,
+             'max_size': max_size,
+             'entries': OrderedDict(),
+             'hits': 0,
+             'misses': 0}
+
+    cache_path = Path(proj_path) / CACHE_FILE_NAME
+
+    if not cache_path.exists():
+        return cache
+
+    try:
+        with cache_path.open() as fp:
+            on_disk = json.load(fp)
+
+        if on_disk['version'] == version:
+            cache['entries'].update((item, (hit, score))
+                                    for item, hit, score in on_disk['entries'])
+            evict(cache)
+
+    except (ValueError, KeyError, TypeError):
+        print('could not read', cache_path, '- starting an empty cache')
+        cache['entries'].clear()
+
+    return cache
+
+
+def save_match_cache(cache, proj_path):
+
+    on_disk = {'version': cache['version'],
+               'entries': [[item, hit, score] for item, (hit, score)
+                           in cache['entries'].items()]}
+
+    cache_path = Path(proj_path) / CACHE_FILE_NAME
+    temp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}.tmp')
+
+    with temp_path.open('w') as fp:
+        json.dump(on_disk, fp)
+
+    temp_path.replace(cache_path)
+
+
+def lookup_matches(cache, items):
+    """
+    Returns a dict of (hit, score) tuples for any of items in cache, and
+    counts hits and misses
+    """
+
+    found = {}
+    entries = cache['entries']
+
+    for item in dict.fromkeys(items):
+        if item in entries:
+            entries.move_to_end(item)
+            found[item] = entries[item]
+            cache['hits'] += 1
+        else:
+            cache['misses'] += 1
+
+    return found
+
+
+def store_matches(cache, matches):
+    """
+    Adds a dict of (hit, score) tuples to cache, evicting the least 
+    recently used entries if it is then too big
+    """
+
+    entries = cache['entries']
+
+    for item, match in matches.items():
+        entries[item] = tuple(match)
+        entries.move_to_end(item)
+
+    evict(cache)
+
+
+def evict(cache):
+
+    entries = cache['entries']
+
+    while len(entries) > cache['max_size']:
+        entries.popitem(last=False)
+
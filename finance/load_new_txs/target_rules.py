@@ -0,0 +1,156 @@
+# myfin/finance/load_new_txs/target_rules.py
+
+import json
+from collections import deque
+from pathlib import Path
+
+"""
+Substring and prefix rules assigning accY to _items, eg anything containing
+'tesco' is 'groceries'.  assign_targets() applies them before looking in
+cat_db or fuzzy matching, giving hits with mode 'rule match'.
+
+A rule is a dict like:
+
+    {"pattern": "tesco", "accY": "groceries", "type": "substring"}
+
+where type is 'substring' (the default) or 'prefix'.  Global rules are in
+the 'target_rules' entry of the project config, and rules for an account in
+target_rules.json in its directory.
+
+All patterns are compiled into one Aho-Corasick automaton, so each _item is
+classified in a single pass over its characters, however many rules there
+are.  Where several rules match, account rules beat global ones, then the
+longest pattern wins, then the first listed.
+"""
+
+ACC_RULES_FILE_NAME = 'target_rules.json'
+
+
+def load_target_rules(acc_path, config):
+    """
+    Returns compiled rules (see compile_rules()) for the account at
+    acc_path, or None if there are none
+    """
+
+    acc_rules = []
+    rules_path = Path(acc_path) / ACC_RULES_FILE_NAME
+
+    if rules_path.exists():
+        with rules_path.open() as fp:
+            acc_rules = json.load(fp)
+
+    if not acc_rules and not config.get('target_rules'):
+        return None
+
+    return compile_rules(acc_rules, config.get('target_rules', []))
+
+
+def compile_rules(acc_rules, global_rules=()):
+    """
+    Returns a dict of the rules, with an automaton of their patterns and
+    the priority of each
+    """
+
+    rules = []
+    priorities = []
+
+    for is_global, rule_list in enumerate([acc_rules, global_rules]):
+        for rule in rule_list:
+            rule = dict(rule, pattern=rule['pattern'].casefold())
+            rule.setdefault('type', 'substring')
+
+            priorities.append((is_global, -len(rule['pattern']), len(rules)))
+            rules.append(rule)
+
+    return {'rules': rules,
+            'priorities': priorities,
+            'automaton': build_automaton([x['pattern'] for x in rules])}
+
+
+def build_automaton(patterns):
+    """
+    Returns an Aho-Corasick automaton for patterns, as a dict of lists of
+    goto transitions, failure links and outputs (pattern positions) for
+    each node.  Node 0 is the root.
+    """
+
+    goto = [{}]
+    fail = [0]
+    out = [[]]
+
+    # trie of the patterns
+    for i, pattern in enumerate(patterns):
+        node = 0
+        for char in pattern:
+            if char not in goto[node]:
+                goto.append({})
+                fail.append(0)
+                out.append([])
+                goto[node][char] = len(goto) - 1
+            node = goto[node][char]
+        out[node].append(i)
+
+    # failure links, breadth first
+    queue = deque(goto[0].values())
+
+    while queue:
+        node = queue.popleft()
+
+        for char, child in goto[node].items():
+            queue.append(child)
+
+            link = fail[node]
+            while link and char not in goto[link]:
+                link = fail[link]
+
+            fail[child] = goto[link].get(char, 0)
+            out[child] = out[child] + out[fail[child]]
+
+    return {'goto': goto, 'fail': fail, 'out': out}
+
+
+def find_patterns(automaton, text):
+    """
+    Yields (pattern position, end position in text) for every occurrence
+    of a pattern in text
+    """
+
+    goto, fail, out = automaton['goto'], automaton['fail'], automaton['out']
+    node = 0
+
+    for end, char in enumerate(text):
+        while node and char not in goto[node]:
+            node = fail[node]
+
+        node = goto[node].get(char, 0)
+
+        for i in out[node]:
+            yield i, end
+
+
+def apply_target_rules(_items, target_rules):
+    """
+    Returns a dict of accY for those of _items matching a rule in
+    target_rules (from compile_rules())
+    """
+
+    rules = target_rules['rules']
+    priorities = target_rules['priorities']
+
+    hits = {}
+
+    for _item in dict.fromkeys(_items):
+        best = None
+
+        for i, end in find_patterns(target_rules['automaton'], _item):
+            if (rules[i]['type'] == 'prefix'
+                  and end + 1 != len(rules[i]['pattern'])):
+                continue
+
+            if best is None or priorities[i] < priorities[best]:
+                best = i
+
+        if best is not None:
+            hits[_item] = rules[best]['accY']
+
+    return hits
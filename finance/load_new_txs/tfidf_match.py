@@ -0,0 +1,151 @@
+# myfin/finance/load_new_txs/tfidf_match.py
+
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+from fuzzywuzzy import utils
+
+from finance.helpers.db_hash import hash_keys
+
+"""
+An alternative to fuzzywuzzy matching, selected with 'match_engine': 'tfidf'
+in the project config.
+
+cat_db keys and new items are made into sparse TF-IDF vectors of character
+n-grams, and each item's hit is the key with the highest cosine similarity
+- found for a whole batch of items with one sparse matrix product.  Scales
+much better than pairwise scoring with large cat_dbs.
+
+Similarities are scaled to 0-100 and used with the same threshold as
+fuzzywuzzy scores, giving 'fuzzy match' hits as before.
+
+The fitted vectorizer and cat_db matrix are kept in cat_db_tfidf.pkl in the
+project dir, and rebuilt if cat_db keys change.
+
+Needs scikit-learn (and so scipy), which fuzzywuzzy matching does not - so
+it is only imported when a model is built.
+"""
+
+MODEL_FILE_NAME = 'cat_db_tfidf.pkl'
+NGRAM_RANGE = (2, 4)
+
+
+def build_tfidf_model(keys):
+    """
+    Returns a dict with a vectorizer fitted on the unique keys (eg of 
+    cat_db), and their tfidf matrix - or neither if there are no keys, as
+    there is no vocabulary to fit, so nothing matches
+    """
+
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    keys = list(dict.fromkeys(keys))
+
+    if not keys:
+        return {'keys': keys, 'keys_hash': hash_keys(keys),
+                'vectorizer': None, 'matrix': None}
+
+    vectorizer = TfidfVectorizer(analyzer='char_wb', ngram_range=NGRAM_RANGE,
+                                 preprocessor=utils.full_process)
+
+    return {'keys': keys,
+            'keys_hash': hash_keys(keys),
+            'vectorizer': vectorizer,
+            'matrix': vectorizer.fit_transform(keys)}
+
+
+def load_tfidf_model(proj_path, cat_db):
+    """
+    Loads the model in proj_path, rebuilding it (and writing it out) if
+    it is missing, cannot be read, or does not match the keys of the
+    passed cat_db
+    """
+
+    model_path = Path(proj_path) / MODEL_FILE_NAME
+
+    if model_path.exists():
+        try:
+            with model_path.open('rb') as fp:
+                model = pickle.load(fp)
+
+            if model['keys_hash'] == hash_keys(cat_db.index):
+                return model
+
+            print('cat_db has changed since', MODEL_FILE_NAME,
+                  'was written - rebuilding it')
+
+        except (pickle.UnpicklingError, EOFError, KeyError, TypeError):
+            print('could not read', model_path, '- rebuilding it')
+
+    model = build_tfidf_model(cat_db.index)
+    save_tfidf_model(model, proj_path)
+
+    return model
+
+
+def save_tfidf_model(model, proj_path):
+    """
+    Writes model to proj_path, via a temp file so a run loading it at the
+    same time never reads a part written file
+    """
+
+    model_path = Path(proj_path) / MODEL_FILE_NAME
+    temp_path = model_path.with_name(f'{model_path.name}.{os.getpid()}.tmp')
+
+    with temp_path.open('wb') as fp:
+        pickle.dump(model, fp)
+
+    temp_path.replace(model_path)
+
+
+def top_k_similar(items, model, k=1, chunk_size=1000):
+    """
+    Returns a list with, for each of items, a list of the k most similar
+    keys in model, as (key, score) tuples with scores from 0 to 100.
+
+    Items are compared with all keys in one sparse product per chunk of
+    chunk_size items.
+    """
+
+    items = list(items)
+    out = []
+
+    if not model['keys']:
+        return [[] for item in items]
+
+    for start in range(0, len(items), chunk_size):
+        vectors = model['vectorizer'].transform(items[start:start + chunk_size])
+
+        # rows are l2 normalised, so this is cosine similarity
+        similarities = (vectors @ model['matrix'].T).tocsr()
+
+        for i in range(similarities.shape[0]):
+            row = similarities.getrow(i)
+
+            # highest first, with ties going to the earliest key
+            top = np.lexsort((row.indices, -row.data))[:k]
+
+            out.append([(model['keys'][row.indices[j]],
+                         int(round(100 * row.data[j]))) for j in top])
+
+    return out
+
+
+def tfidf_match(items, model, threshold=55):
+    """
+    Returns a list aligned with items of (hit, score) tuples, where hit
+    is False if the score is less than threshold - as batch_fuzzy_match()
+    """
+
+    matches = []
+
+    for similar in top_k_similar(items, model, k=1):
+
+        if similar and similar[0][1] >= threshold:
+            matches.append(similar[0])
+        else:
+            matches.append((False, similar[0][1] if similar else 0))
+
+    return matches
@@ -1,28 +1,53 @@
 # myfin/finance/load_new_txs/trim_df.py
 
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from termcolor import cprint
 
-def trim_df(df, tx_db, confirm_dups=False):
+from .tx_fingerprints import (get_fingerprints, get_dates, get_numbers,
+                              get_check_cols, make_fingerprint_index,
+                              find_fingerprints)
+
+
+def trim_df(df, tx_db, confirm_dups=False, fingerprint_index=None):
     """
     For an input df of new txs and an existing tx_db, return the input
-    df trimmed of txs found in tx_db.
+    df trimmed of txs found in tx_db, with a fingerprint column.
+
+    Txs are compared by fingerprint with those of the same account in
+    their date range, and by any CHECK_COLS df has (see
+    tx_fingerprints.py) - pass a fingerprint_index of tx_db if there is
+    one, or one is made here, indexing just those txs.
     """
 
-    # use common cols to index both dfs
-    common_cols = set(tx_db.reset_index().columns).intersection(df.columns)
-    common_cols = [x for x in common_cols if x != 'source']
+    df = df.reset_index(drop=True)
+    df['fingerprint'] = get_fingerprints(df)
+
+    dates = get_dates(df)
+    accXs = df['accX'].astype(object).values
+    checks = {col: get_numbers(df, col).values for col in get_check_cols(df)}
+
+    if fingerprint_index is None:
+        fingerprint_index = make_fingerprint_index(tx_db, margin=0)
+
+    # keep the txs in their order in df, so trimming a df in chunks gives
+    # the same as trimming it whole
+    is_dup = np.zeros(len(df), dtype=bool)
 
-    # best to put everything in the index and use built-in set logic
-    tx_db_by_cc = tx_db.reset_index().set_index(common_cols)
-    df_by_cc = df.reset_index(drop=True).set_index(common_cols)
+    for accX in pd.unique(accXs):
+        is_acc = accXs == accX
+        acc_dates = dates[is_acc]
 
-    duplicate_tups = df_by_cc.index.intersection(tx_db_by_cc.index)
-    unique_tups = df_by_cc.index.difference(tx_db_by_cc.index)
+        is_dup[is_acc] = find_fingerprints(
+                             fingerprint_index, tx_db, accX,
+                             df['fingerprint'].values[is_acc],
+                             acc_dates.min(), acc_dates.max(),
+                             {col: values[is_acc]
+                              for col, values in checks.items()})
 
-    duplicates = df_by_cc.loc[duplicate_tups].reset_index().set_index('date')
-    uniques = df_by_cc.loc[unique_tups].reset_index().set_index('date')
+    duplicates = df[is_dup].set_index('date')
+    uniques = df[~is_dup].set_index('date')
 
     if uniques.empty:
         print('ALL TXS TRIMMED OFF!!!')
@@ -0,0 +1,292 @@
+# myfin/finance/load_new_txs/tx_fingerprints.py
+
+import numpy as np
+import pandas as pd
+
+"""
+Fingerprints of txs, for finding those already in tx_db.
+
+A tx's fingerprint is a 53 bit hash of its FINGERPRINT_COLS, which every
+statement has, normalised so the same tx hashes the same whether read from
+a csv or from tx_db (in any storage).  tx_db keeps them in its
+'fingerprint' column.
+
+CHECK_COLS are only compared where the new txs have them, as trim_df()
+always compared the columns common to the new txs and tx_db - so a csv
+without eg a balance column still matches the same txs loaded from one
+with, but txs differing in a balance both have are not duplicates.
+
+A fingerprint index holds each account's fingerprints and CHECK_COLS
+values with their dates, sorted by date:
+
+    {'n_txs': <rows of tx_db it indexes lazily>,
+     'margin': <Timedelta>,
+     'covered': {accX: (<first date>, <last date>)},
+     'accounts': {accX: {'dates': <datetime64 array>,
+                         'fingerprints': <int64 array>,
+                         'y_amt': <float64 array>,
+                         'balance': <float64 array>}}}
+
+so new txs are only compared with those of their account within their
+own dates, found by binary search.  The first n_txs rows of tx_db are
+only indexed when looked for - those of the account within margin of the
+dates looked for, widening what is covered as later txs need - so the
+cost depends on the new txs, not on the size of tx_db.  Txs appended to
+tx_db after those are added with update_fingerprint_index().
+"""
+
+FINGERPRINT_COLS = ['date', 'accX', 'net_amt', 'ITEM']
+
+CHECK_COLS = ['y_amt', 'balance']
+
+TEXT_COLS = ['accX', 'ITEM']
+
+# how far either side of the dates looked for an index covers tx_db, so
+# the next chunk of a statement is likely covered already
+WINDOW_MARGIN = pd.Timedelta(days=31)
+
+
+def get_col(df, col):
+    """
+    Returns col of df as a series with a range index, whether a column or
+    in the index (eg tx_db's date), or all nan if neither
+    """
+
+    if col in df.columns:
+        return df[col].reset_index(drop=True)
+
+    if col in df.index.names:
+        return pd.Series(df.index.get_level_values(col))
+
+    return pd.Series(np.nan, index=range(len(df)))
+
+
+def get_dates(df):
+    """
+    Returns the dates of the txs in df, as datetime64[ns] days
+    """
+
+    return (pd.to_datetime(get_col(df, 'date')).dt.normalize()
+              .astype('datetime64[ns]'))
+
+
+def get_numbers(df, col):
+    """
+    Returns col of df as float64s, with nan for anything not a number
+    """
+
+    return pd.to_numeric(get_col(df, col), errors='coerce').astype('float64')
+
+
+def get_check_cols(df):
+    """
+    Returns the CHECK_COLS that df has
+    """
+
+    return [col for col in CHECK_COLS if col in df.columns]
+
+
+def get_check_keys(fingerprints, checks):
+    """
+    Returns an array of hashes of fingerprints with the values in checks, a
+    dict of CHECK_COLS and their values for the same txs
+    """
+
+    keys = pd.DataFrame({'fingerprint': np.asarray(fingerprints,
+                                                   dtype='int64'),
+                         **{col: np.asarray(values, dtype='float64')
+                            for col, values in checks.items()}})
+
+    return pd.util.hash_pandas_object(keys, index=False).values
+
+
+def get_fingerprints(df):
+    """
+    Returns an array of the fingerprints of the txs in df (new txs, or
+    tx_db with its date index)
+    """
+
+    normalised = {}
+    for col in FINGERPRINT_COLS:
+
+        if col == 'date':
+            values = get_dates(df)
+
+        elif col in TEXT_COLS:
+            values = get_col(df, col).astype(object)
+            values = values.where(values.notnull(), '').astype(str)
+
+        else:
+            values = get_numbers(df, col)
+
+        normalised[col] = values
+
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(normalised), index=False)
+
+    # kept to 53 bits, so they are exact even if read in as floats (eg
+    # from a csv or sqlite column with some missing)
+    return (hashes.values >> np.uint64(11)).astype('int64')
+
+
+def add_fingerprints(tx_db):
+    """
+    Returns tx_db with fingerprints for any txs without them (eg those
+    loaded before they were kept)
+    """
+
+    if not 'fingerprint' in tx_db.columns:
+        tx_db['fingerprint'] = pd.array([pd.NA] * len(tx_db), dtype='Int64')
+
+    missing = tx_db['fingerprint'].isnull().values
+
+    if missing.any():
+        fingerprints = tx_db['fingerprint'].astype('Int64').array.copy()
+        fingerprints[missing] = get_fingerprints(tx_db[missing])
+        tx_db['fingerprint'] = fingerprints
+
+    return tx_db
+
+
+def get_tx_db_window(tx_db, start, end, accounts):
+    """
+    Returns the txs in tx_db on the days start to end (inclusive), of
+    accounts - found by binary search if tx_db is sorted by date
+    """
+
+    dates = tx_db.index
+    start = pd.Timestamp(start).normalize()
+    end = pd.Timestamp(end).normalize() + pd.Timedelta(days=1)
+
+    if dates.is_monotonic_increasing:
+        window = tx_db.iloc[dates.searchsorted(start, side='left'):
+                            dates.searchsorted(end, side='left')]
+    else:
+        window = tx_db[(dates >= start) & (dates < end)]
+
+    return window[window['accX'].isin(accounts).values]
+
+
+def make_fingerprint_index(tx_db, margin=WINDOW_MARGIN):
+    """
+    Returns a fingerprint index of the txs in tx_db, with nothing indexed
+    until looked for (see cover_fingerprint_window())
+    """
+
+    return {'n_txs': len(tx_db),
+            'margin': pd.Timedelta(margin),
+            'covered': {},
+            'accounts': {}}
+
+
+def cover_fingerprint_window(fingerprint_index, tx_db, accX, start, end):
+    """
+    Adds the txs of accX in tx_db dated start to end (inclusive) to
+    fingerprint_index, in place, unless it covers those dates already - and
+    those within its margin, on the side(s) it is widened.  Only the rows
+    of tx_db the index was made of are read, as any after are added by
+    update_fingerprint_index().
+    """
+
+    start = pd.Timestamp(start).normalize()
+    end = pd.Timestamp(end).normalize()
+    covered = fingerprint_index['covered'].get(accX)
+
+    if covered is not None and covered[0] <= start and end <= covered[1]:
+        return
+
+    margin = fingerprint_index['margin']
+    new_start, new_end = start - margin, end + margin
+
+    if covered is None:
+        windows = [(new_start, new_end)]
+    else:
+        new_start = min(new_start, covered[0])
+        new_end = max(new_end, covered[1])
+        windows = [(new_start, covered[0] - pd.Timedelta(days=1)),
+                   (covered[1] + pd.Timedelta(days=1), new_end)]
+
+    tx_db = tx_db.iloc[:fingerprint_index['n_txs']]
+
+    for window_start, window_end in windows:
+        if window_start > window_end:
+            continue
+
+        window = get_tx_db_window(tx_db, window_start, window_end, [accX])
+
+        if ('fingerprint' not in window.columns
+              or window['fingerprint'].isnull().any()):
+            window = add_fingerprints(window.copy())
+
+        index_txs(fingerprint_index['accounts'], window)
+
+    fingerprint_index['covered'][accX] = (new_start, new_end)
+
+
+def update_fingerprint_index(fingerprint_index, df):
+    """
+    Adds the txs in df (which have fingerprints), appended to tx_db since
+    fingerprint_index was made, to it in place
+    """
+
+    index_txs(fingerprint_index['accounts'], df)
+
+
+def index_txs(accounts, df):
+    """
+    Adds the txs in df (which have fingerprints) to accounts, the entries
+    of a fingerprint index, in place
+    """
+
+    accXs = get_col(df, 'accX').astype(object).values
+    columns = {'dates': get_dates(df).values,
+               'fingerprints': np.asarray(get_col(df, 'fingerprint').values,
+                                          dtype='int64')}
+    columns.update({col: get_numbers(df, col).values for col in CHECK_COLS})
+
+    for accX in pd.unique(accXs):
+        is_acc = accXs == accX
+
+        order = np.argsort(columns['dates'][is_acc], kind='stable')
+        new_entry = {key: values[is_acc][order]
+                     for key, values in columns.items()}
+
+        if accX not in accounts:
+            accounts[accX] = new_entry
+            continue
+
+        # merge the new txs in, after any on the same dates
+        entry = accounts[accX]
+        positions = entry['dates'].searchsorted(new_entry['dates'],
+                                                side='right')
+
+        accounts[accX] = {key: np.insert(entry[key], positions,
+                                         new_entry[key])
+                          for key in entry}
+
+
+def find_fingerprints(fingerprint_index, tx_db, accX, fingerprints, start,
+                      end, checks=None):
+    """
+    Returns a boolean array of whether each of fingerprints is in
+    fingerprint_index (of tx_db) for a tx of accX dated start to end
+    (inclusive) - and, if checks (a dict of CHECK_COLS and their values
+    for the same txs) is given, with the same values of those
+    """
+
+    cover_fingerprint_window(fingerprint_index, tx_db, accX, start, end)
+
+    if accX not in fingerprint_index['accounts']:
+        return np.zeros(len(fingerprints), dtype=bool)
+
+    entry = fingerprint_index['accounts'][accX]
+
+    lo = entry['dates'].searchsorted(np.datetime64(start, 'ns'), side='left')
+    hi = entry['dates'].searchsorted(np.datetime64(end, 'ns'), side='right')
+
+    if not checks:
+        return np.isin(fingerprints, entry['fingerprints'][lo:hi])
+
+    candidates = get_check_keys(entry['fingerprints'][lo:hi],
+                                {col: entry[col][lo:hi] for col in checks})
+
+    return np.isin(get_check_keys(fingerprints, checks), candidates)
@@ -0,0 +1,59 @@
+# myfin/finance/tests/test_archive_dbs.py
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from finance.helpers.constants import DB_NAMES
+from finance.load_new_txs.archive_dbs import archive_dbs, restore_snapshot
+
+from .test_helpers import print_title
+
+
+def write_dbs_text(proj_path, version):
+    """
+    Writes a csv for each of the dbs in proj_path, with contents varying
+    with version, and returns a dict of them
+    """
+
+    texts = {db: f'_item,{db}\nitem,{version}\n' for db in DB_NAMES}
+
+    for db, text in texts.items():
+        (Path(proj_path) / (db + '.csv')).write_text(text)
+
+    return texts
+
+
+def test_archive_dbs(n_snapshots=5):
+    """
+    Archives dbs several times in quick succession (likely the same
+    second) and checks each snapshot restores the dbs as they were, and a
+    date restores the last of that day
+    """
+
+    print_title('Testing archive_dbs() and restore_snapshot()')
+
+    with TemporaryDirectory() as proj_path:
+        proj_path = Path(proj_path)
+        archived = []
+
+        for version in range(n_snapshots):
+            texts = write_dbs_text(proj_path, version)
+            timestamp = archive_dbs(proj_path=proj_path, storage='csv',
+                                    annotation=f'version {version}')
+            archived.append((timestamp, texts))
+
+        timestamps = [x for x, _ in archived]
+        assert len(set(timestamps)) == n_snapshots
+        assert timestamps == sorted(timestamps)
+
+        for timestamp, texts in archived:
+            snapshot = restore_snapshot(timestamp, proj_path=proj_path)
+            assert snapshot['timestamp'] == timestamp
+
+            for db, text in texts.items():
+                assert (proj_path / (db + '.csv')).read_text() == text
+
+        snapshot = restore_snapshot(timestamps[-1][:8], proj_path=proj_path)
+        assert snapshot['timestamp'] == timestamps[-1]
+
+    print(f'{n_snapshots} snapshots archived and restored')
@@ -0,0 +1,76 @@
+# myfin/finance/tests/test_fuzzy_match.py
+
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+from fuzzywuzzy import fuzz, process
+
+from finance.load_new_txs.batch_fuzzy_match import batch_fuzzy_match
+from finance.load_new_txs.tfidf_match import load_tfidf_model, tfidf_match
+
+REFERENCE_SET = ['tesco stores 3021', 'tesco metro', 'sainsburys s/mkt',
+                 'amazon.co.uk', 'amazon mktplace pmts', 'tfl travel ch',
+                 'tfl.gov.uk/cp', 'pret a manger', 'Pret A Manger ',
+                 'shell petrol', 'netflix.com', 'spotify p0a1b2c3']
+
+ITEMS = ['tesco stores 4410', 'metro tesco', 'amazon.co.uk*mk2', 'tfl',
+         'pret a manger', 'pret', 'shell', 'spotify', 'xyz', '',
+         'netflix.com', 'tesco stores 4410']
+
+
+def extract_one_match(input_string, reference_set, threshold=55):
+    """
+    The original one-item-at-a-time make_fuzzy_match(), as a reference
+    """
+
+    scorers = {'ratio': fuzz.ratio,
+               'token_set_ratio': fuzz.token_set_ratio,
+               'token_sort_ratio': fuzz.token_sort_ratio,
+              }
+
+    matches = {}
+    for scorer in scorers:
+        matches[scorer] = process.extractOne(input_string, reference_set,
+                                             scorer=scorers[scorer])
+
+    top_hit = max(matches, key=lambda x: matches[x][1])
+
+    if matches[top_hit][1] >= threshold:
+        return matches[top_hit][0], matches[top_hit][1]
+
+    return False, matches[top_hit][1]
+
+
+def test_batch_fuzzy_match(items=ITEMS, reference_set=REFERENCE_SET):
+    """
+    Checks batch_fuzzy_match() gives the same hits as matching each item
+    separately, and the same scores where there is a hit.
+
+    (Scores below the threshold are not exact, as weak references are
+    skipped.)
+    """
+
+    expected = [extract_one_match(x, reference_set) for x in items]
+    expected = [x if x[0] else x[0] for x in expected]
+
+    for max_cells in [10**7, 5]:
+        actual = batch_fuzzy_match(items, reference_set, max_cells=max_cells)
+        actual = [x if x[0] else x[0] for x in actual]
+
+        assert actual == expected
+
+
+def test_tfidf_empty_cat_db(items=ITEMS):
+    """
+    Checks a tfidf model of an empty cat_db can be built and loaded again,
+    and matches none of items
+    """
+
+    cat_db = pd.DataFrame({'_item': [], 'accX': [], 'accY': []}
+                         ).set_index('_item')
+
+    with TemporaryDirectory() as proj_path:
+        for _ in range(2):
+            model = load_tfidf_model(proj_path, cat_db)
+
+            assert tfidf_match(items, model) == [(False, 0)] * len(items)
@@ -0,0 +1,43 @@
+# myfin/finance/tests/test_lookups.py
+
+import pandas as pd
+
+from finance.load_new_txs.add_target_acc_col import pick_match
+from finance.load_new_txs.make_lookups import (make_lookup, update_lookup,
+                                                pick_from_lookup)
+
+CAT_DB = pd.DataFrame({'_item': ['tesco', 'tesco', 'tesco', 'shell',
+                                 'shell', 'tfl', 'pret'],
+                       'accX': ['acc1', 'acc2', 'acc2', 'acc2',
+                                'acc3', 'acc1', 'acc1'],
+                       'accY': ['groceries', 'food', 'other', 'fuel',
+                                'car', 'travel', 'lunch']}
+                     ).set_index('_item')
+
+
+def test_pick_from_lookup(db=CAT_DB):
+    """
+    Checks lookups give the same accY as pick_match() for every item and
+    account, including after updating some entries
+    """
+
+    lookup = make_lookup(db)
+
+    for account in ['acc1', 'acc2', 'acc3', 'acc4']:
+        for _item in db.index.unique():
+            assert (pick_from_lookup(lookup, _item, account)
+                    == pick_match(_item, account, db.loc[[_item]]))
+
+    new_rows = pd.DataFrame({'accX': ['acc3', 'acc2'],
+                             'accY': ['travel', 'snacks']},
+                            index=pd.Index(['tfl', 'crisps'], name='_item'))
+    db = pd.concat([db, new_rows])
+    update_lookup(lookup, db, new_rows.index)
+
+    assert lookup == make_lookup(db)
+
+    # dropping an account's only item drops its partition
+    db = db.drop('shell')
+    update_lookup(lookup, db, ['shell'])
+
+    assert lookup == make_lookup(db)
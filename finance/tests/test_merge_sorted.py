@@ -0,0 +1,55 @@
+# myfin/finance/tests/test_merge_sorted.py
+
+import numpy as np
+import pandas as pd
+
+from finance.load_new_txs.append_to_dbs import (tidy, is_tidy, ensure_tidy,
+                                                merge_sorted)
+
+from .test_helpers import print_title
+
+
+def make_db_rows(rng, n_rows, n_items):
+    """
+    Returns a df of n_rows random rows like those of unknowns_db, with
+    _items from n_items of them - so some repeat, with the same or other
+    accX and accY, and some accX are missing
+    """
+
+    items = [f'item {i:05d}' for i in range(n_items)]
+
+    return pd.DataFrame({'_item': rng.choice(items, n_rows),
+                         'accX': rng.choice(['acc1', 'acc2', np.nan], n_rows),
+                         'accY': rng.choice(['food', 'fuel', 'unknown'],
+                                            n_rows).astype(object),
+                        }).set_index('_item')
+
+
+def test_merge_sorted(n_trials=1000, seed=0):
+    """
+    Checks merge_sorted() gives the same as tidy() of the dbs concatenated,
+    for random tidy dbs and new rows - including none of either, and
+    new rows with _items before, after and among those of the db
+    """
+
+    print_title('Testing merge_sorted() against tidy()')
+
+    rng = np.random.default_rng(seed)
+
+    for trial in range(n_trials):
+        db = tidy(make_db_rows(rng, rng.integers(0, 60), 30))
+        new_rows = make_db_rows(rng, rng.integers(0, 20), 40)
+
+        target = tidy(pd.concat([db, new_rows]))
+        merged = merge_sorted(db, new_rows)
+
+        # compared as objects - with no new rows, dtypes can differ
+        assert merged.astype(object).equals(target.astype(object)), trial
+        assert list(merged.index) == list(target.index), trial
+        assert is_tidy(merged), trial
+
+    untidy = make_db_rows(rng, 50, 20)
+    assert not is_tidy(untidy)
+    assert ensure_tidy(untidy).equals(tidy(untidy))
+
+    print(f'{n_trials} random merges same as tidy()')
@@ -0,0 +1,101 @@
+# myfin/finance/tests/test_sqlite_updates.py
+
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pandas as pd
+
+from finance.helpers.db_storage import read_db, write_dbs
+from finance.update_dbs import update_dbs_after_changes
+from finance.update_dbs.sqlite_updates import update_sqlite_after_changes
+
+from .test_helpers import print_title
+
+
+def make_curated_dbs():
+    """
+    Returns a dict of dbs after a round of curating fuzzy_db and
+    unknowns_db: a fuzzy match of each status (rejected, confirmed, given
+    a new accY, and none) and an unknown given an accY, and one left
+    unknown - each in tx_db, one for two accounts
+    """
+
+    tx_db = pd.DataFrame({
+        'date': pd.to_datetime(['2020-01-01', '2020-01-02', '2020-01-03',
+                                '2020-01-04', '2020-01-05', '2020-01-06',
+                                '2020-01-07', '2020-01-08']),
+        'accX': ['acc1', 'acc1', 'acc2', 'acc1', 'acc1', 'acc1', 'acc1',
+                 'acc2'],
+        'accY': ['food', 'fuel', 'fuel', 'books', 'food', 'unknown',
+                 'unknown', 'food'],
+        'net_amt': [-1.0, -2.0, -3.0, -4.0, -5.0, -6.0, -7.0, -8.0],
+        'ITEM': ['TESCO', 'SHELL X', 'SHELL X', 'BOOK SHOP', 'CAFE',
+                 'MYSTERY CO', 'ODD THING', 'TESCO'],
+        '_item': ['tesco', 'shell x', 'shell x', 'book shop', 'cafe',
+                  'mystery co', 'odd thing', 'tesco'],
+        'id': range(1, 9),
+        'mode': ['looked up known', 'fuzzy match', 'fuzzy match',
+                 'fuzzy match', 'fuzzy match', 'new unknown', 'new unknown',
+                 'looked up known'],
+    }).set_index('date')
+
+    cat_db = pd.DataFrame({'_item': ['tesco', 'tesco'],
+                           'accX': ['acc1', 'acc2'],
+                           'accY': ['food', 'food']}).set_index('_item')
+
+    fuzzy_db = pd.DataFrame({
+        '_item': ['book shop', 'cafe', 'shell x', 'shell x'],
+        'accX': ['acc1', 'acc1', 'acc1', 'acc2'],
+        'accY': ['books', 'food', 'fuel', 'fuel'],
+        'status': ['rejected', 'drinks', 'confirmed', np.nan],
+    }).set_index('_item')
+
+    unknowns_db = pd.DataFrame({'_item': ['mystery co', 'odd thing'],
+                                'accX': ['acc1', 'acc1'],
+                                'accY': ['gifts', 'unknown']}
+                              ).set_index('_item')
+
+    return {'tx_db': tx_db, 'cat_db': cat_db, 'fuzzy_db': fuzzy_db,
+            'unknowns_db': unknowns_db}
+
+
+def normalise(df):
+    """
+    Returns df with its index as a column, as strings, in a set order - so
+    dbs read back from sqlite compare with those from pandas
+    """
+
+    df = df.reset_index().astype(str)
+
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def test_sqlite_updates():
+    """
+    Checks update_sqlite_after_changes() leaves the dbs in dbs.sqlite the
+    same as update_dbs_after_changes() leaves them in pandas, after a round
+    of curating fuzzy_db then unknowns_db
+    """
+
+    print_title('Testing sqlite curation against pandas')
+
+    dbs = make_curated_dbs()
+
+    for changed_db_name in ['fuzzy_db', 'unknowns_db']:
+        dbs = update_dbs_after_changes(changed_db_name, dbs=dbs,
+                                       return_dbs=True)
+
+    with TemporaryDirectory() as main_dir:
+        write_dbs(make_curated_dbs(), main_dir, 'sqlite')
+
+        for changed_db_name in ['fuzzy_db', 'unknowns_db']:
+            update_sqlite_after_changes(changed_db_name, main_dir)
+
+        for db in dbs:
+            from_sqlite = read_db(main_dir, db, 'sqlite')
+            columns = list(dbs[db].columns)
+
+            assert normalise(from_sqlite[columns]).equals(
+                       normalise(dbs[db])), db
+
+            print(f'{db} the same after curation')
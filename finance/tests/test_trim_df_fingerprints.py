@@ -0,0 +1,119 @@
+# myfin/finance/tests/test_trim_df_fingerprints.py
+
+import numpy as np
+import pandas as pd
+
+from finance.load_new_txs.trim_df import trim_df
+from finance.load_new_txs.tx_fingerprints import (add_fingerprints,
+                                                  make_fingerprint_index,
+                                                  update_fingerprint_index)
+
+from .test_helpers import print_title
+
+
+def make_txs(balances=None):
+    """
+    Returns a df of 3 new txs of acc0, the first 2 of which are in the
+    tx_db from make_tx_db() - with a balance column if balances are given
+    """
+
+    df = pd.DataFrame({'date': pd.to_datetime(['2020-01-01', '2020-01-02',
+                                               '2020-01-03']),
+                       'accX': 'acc0',
+                       'net_amt': [10.0, -5.5, 7.25],
+                       'ITEM': ['tesco', 'shell', 'boots']})
+
+    if balances is not None:
+        df['balance'] = balances
+
+    return df
+
+
+def make_tx_db():
+    """
+    Returns a tx_db holding the first 2 txs of make_txs(), with balances
+    """
+
+    tx_db = make_txs([100.0, 94.5, 101.75]).iloc[:2].set_index('date')
+    tx_db['accY'] = 'groceries'
+    tx_db['y_amt'] = np.nan
+
+    return add_fingerprints(tx_db)
+
+
+def test_trim_df_fingerprints():
+    """
+    Checks txs already in tx_db are trimmed whether or not the new txs have
+    a balance column, but not if their balances differ - with and without
+    a fingerprint index
+    """
+
+    print_title('Testing trim_df() by fingerprint')
+
+    tx_db = make_tx_db()
+
+    cases = {'same balances': ([100.0, 94.5, 101.75], ['boots']),
+             'no balance column': (None, ['boots']),
+             'different balance': ([100.0, 90.0, 101.75], ['shell', 'boots'])}
+
+    for name, (balances, target) in cases.items():
+        for fingerprint_index in [None, make_fingerprint_index(tx_db)]:
+            trimmed = trim_df(make_txs(balances), tx_db,
+                              fingerprint_index=fingerprint_index)
+
+            assert trimmed['ITEM'].tolist() == target, name
+
+        print(f'{name}: kept {target}')
+
+
+def make_history(n_days=730):
+    """
+    Returns a tx_db of a tx a day for each of 2 accounts, over n_days from
+    2019-01-01
+    """
+
+    dates = pd.date_range('2019-01-01', periods=n_days)
+
+    tx_db = pd.DataFrame({'date': dates.repeat(2),
+                          'accX': ['acc0', 'acc1'] * n_days,
+                          'net_amt': np.arange(2 * n_days) / 4,
+                          'ITEM': 'shop'}).set_index('date')
+    tx_db['accY'] = 'groceries'
+
+    return add_fingerprints(tx_db)
+
+
+def test_lazy_fingerprint_index():
+    """
+    Checks trimming chunks of acc0 txs far apart in time with one
+    fingerprint index gives the same as without, while indexing only acc0
+    txs, and not all of them - and that txs added to the index after it
+    was made are trimmed too
+    """
+
+    print_title('Testing the lazy fingerprint index')
+
+    tx_db = make_history()
+    fingerprint_index = make_fingerprint_index(tx_db)
+
+    old = tx_db[tx_db['accX'] == 'acc0'].reset_index()
+    new = old.assign(net_amt=old['net_amt'] + 0.1)
+
+    for start in [400, 600, 100, 110]:
+        chunk = pd.concat([old.iloc[start:start + 10],
+                           new.iloc[start + 5:start + 15]])
+
+        trimmed = trim_df(chunk, tx_db, fingerprint_index=fingerprint_index)
+        target = trim_df(chunk, tx_db)
+
+        assert trimmed.equals(target), start
+        assert len(trimmed) == 10, start
+
+    indexed = fingerprint_index['accounts']
+    assert list(indexed) == ['acc0']
+    assert len(indexed['acc0']['dates']) < len(old)
+
+    update_fingerprint_index(fingerprint_index, trimmed)
+    assert trim_df(chunk, tx_db, fingerprint_index=fingerprint_index).empty
+
+    print(f'{len(indexed["acc0"]["dates"])} of {len(tx_db)} txs indexed')
@@ -0,0 +1,65 @@
+# myfin/finance/tests/test_tx_db_partitions.py
+
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+
+from finance.helpers.constants import TX_DB_COLUMNS
+from finance.helpers.db_storage import read_db, read_tx_db, write_db
+
+from .test_helpers import print_title
+
+
+def make_tx_db():
+    """
+    Returns a tx_db of 4 txs in 2020, of 2 accounts
+    """
+
+    return pd.DataFrame({
+        'date': pd.to_datetime(['2020-01-01', '2020-02-01', '2020-03-01',
+                                '2020-04-01']),
+        'accX': ['acc1', 'acc2', 'acc1', 'acc2'],
+        'accY': ['food', 'fuel', 'food', 'fuel'],
+        'net_amt': [-1.0, -2.0, -3.0, -4.0],
+        'ITEM': ['TESCO', 'SHELL', 'TESCO', 'SHELL'],
+        '_item': ['tesco', 'shell', 'tesco', 'shell'],
+        'id': range(1, 5),
+    }).set_index('date')
+
+
+def test_tx_db_partitions():
+    """
+    Checks a partitioned tx_db reads back as no txs, with its columns, when
+    no partition matches the dates or accounts asked for, or when it was
+    written with no txs - and reads those that do match
+    """
+
+    print_title('Testing reading tx_db partitions')
+
+    with TemporaryDirectory() as main_dir:
+        write_db(make_tx_db(), main_dir, 'tx_db', 'csv', partition_by='year')
+
+        cases = {'later dates': ({'start_date': '2021-01-01'}, []),
+                 'other account': ({'accounts': ['zz']}, []),
+                 'one account': ({'accounts': ['acc1']}, [1, 3]),
+                 'some dates': ({'start_date': '2020-02-01',
+                                 'end_date': '2020-03-01'}, [2, 3])}
+
+        for name, (selection, target) in cases.items():
+            df = read_tx_db(main_dir, 'csv', **selection)
+
+            assert df['id'].tolist() == target, name
+            if not target:
+                assert set(TX_DB_COLUMNS) <= set(df.columns), name
+
+            print(f'{name}: read ids {target}')
+
+        write_db(make_tx_db().iloc[:0], main_dir, 'tx_db', 'csv',
+                 partition_by='year')
+
+        for df in [read_db(main_dir, 'tx_db'), read_tx_db(main_dir, 'csv')]:
+            assert df.empty
+            assert isinstance(df.index, pd.DatetimeIndex)
+            assert set(TX_DB_COLUMNS) <= set(df.columns)
+
+        print('empty tx_db read back with no txs')
@@ -0,0 +1,77 @@
+# myfin/finance/tests/test_tx_db_segments.py
+
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+
+from mylogger import get_filelog
+
+from finance.helpers.db_storage import (read_db, write_db, get_segments,
+                                        make_staging_path, stage_segment)
+from finance.helpers.load_config import load_config
+from finance.load_new_txs.load_new_txs import write_new_dbs
+from finance.load_new_txs.tx_fingerprints import add_fingerprints
+
+from .test_helpers import print_title
+
+
+def make_tx_rows(load, n_rows=3):
+    """
+    Returns n_rows of tx_db for a load, each load's on later dates
+    """
+
+    tx_rows = pd.DataFrame({
+        'date': pd.date_range('2020-01-01', periods=n_rows) +
+                pd.Timedelta(days=n_rows * load),
+        'accX': 'acc1',
+        'accY': 'food',
+        'net_amt': [-1.0 - load] * n_rows,
+        'ITEM': [f'SHOP {load} {i}' for i in range(n_rows)],
+        '_item': [f'shop {load} {i}' for i in range(n_rows)],
+        'id': range(n_rows * load, n_rows * (load + 1)),
+        'mode': 'looked up known',
+    }).set_index('date')
+
+    return add_fingerprints(tx_rows)
+
+
+def test_tx_db_segments(n_loads=5, compact_after=2):
+    """
+    Checks loads that stage their tx_db rows as segments compact tx_db once
+    there are compact_after segments, as appending them unstaged does - and
+    that tx_db reads back the same
+    """
+
+    print_title('Testing tx_db segments are compacted')
+
+    with TemporaryDirectory() as main_dir:
+        main_dir = Path(main_dir)
+        (main_dir / 'config.json').write_text(json.dumps(
+            {'tx_db_segments': True, 'tx_db_compact_after': compact_after}))
+
+        config = load_config(main_dir)
+        logger = get_filelog(main_dir / 'log.txt')
+
+        tx_db = make_tx_rows(0)
+        write_db(tx_db, main_dir, 'tx_db', config['storage'])
+
+        for load in range(1, n_loads + 1):
+            n_old_txs = len(tx_db)
+            tx_db = pd.concat([tx_db, make_tx_rows(load)])
+
+            staging_path = make_staging_path(main_dir)
+            stage_segment(tx_db.iloc[n_old_txs:], staging_path,
+                          config['storage'])
+
+            write_new_dbs({'tx_db': tx_db}, n_old_txs, main_dir, config,
+                          logger, staging_path=staging_path)
+
+            assert len(get_segments(main_dir)) < compact_after, load
+            assert not Path(staging_path).exists(), load
+
+            from_disk = read_db(main_dir, 'tx_db', config['storage'])
+            assert from_disk['ITEM'].tolist() == tx_db['ITEM'].tolist(), load
+
+    print(f'{n_loads} loads kept under {compact_after} segments')
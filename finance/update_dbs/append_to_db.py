@@ -19,7 +19,7 @@ def append_to_db(db, tuples_to_append, new_vals, column='accY'):
     by_tup = get_db_by_tuple(db)
     appendee = pd.DataFrame({column: new_vals}, index=tuples_to_append)
     
-    by_tup = by_tup.append([appendee])
+    by_tup = pd.concat([by_tup, appendee])
 
     return by_tup.reset_index().set_index(initial_index)
 
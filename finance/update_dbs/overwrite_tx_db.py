@@ -20,6 +20,14 @@ def overwrite_tx_db(tx_db, tuples_to_change, new_vals, col_to_change='accY',
 
     tx_db_by_tup = get_db_by_tuple(tx_db)
 
+    # categoricals only take values in their categories
+    if tx_db_by_tup[col_to_change].dtype.name == 'category':
+        new_vals = list(new_vals)
+        new_cats = (pd.Index(new_vals).dropna().unique()
+                      .difference(tx_db_by_tup[col_to_change].cat.categories))
+        tx_db_by_tup[col_to_change] = (tx_db_by_tup[col_to_change]
+                                           .cat.add_categories(new_cats))
+
     # select those to change, excluding those with 'manual' mode
     mask = tx_db_by_tup.index.isin(tuples_to_change)
     
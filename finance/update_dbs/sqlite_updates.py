@@ -0,0 +1,231 @@
+# myfin/finance/update_dbs/sqlite_updates.py
+
+from pathlib import Path
+import pandas as pd
+
+from finance.helpers.db_storage import (connect, read_db, apply_schema,
+                                        refresh_arrow_export, write_file,
+                                        CURATION_DBS, INDEX_COLS)
+from finance.load_new_txs.gram_index import update_gram_index
+
+from .get_db_by_tuple import get_db_by_tuple
+
+"""
+update_dbs_after_changes() for projects with 'sqlite' storage.
+
+The same changes as update_after_changed_fuzzy() and
+update_after_changed_unknowns() are made, but as set-based statements on
+the tables in dbs.sqlite, all in one transaction - so only the curated
+db is loaded into pandas, and the cost depends on the number of rows
+changed, not the size of tx_db and cat_db.
+
+The (_item, accX) pairs to change, with their new values, are put in a
+temporary 'changes' table, and joined to the other tables on their
+(_item, accX) indexes.
+"""
+
+
+def update_sqlite_after_changes(changed_db_name, main_dir, gram_index=None):
+    """
+    Syncs the curated csv of changed_db_name (either 'fuzzy_db' or
+    'unknowns_db') into dbs.sqlite in main_dir, and applies the changes
+    to the other tables.  Rewrites the curation csvs from the tables.
+
+    If a gram_index of cat_db is passed, it is updated in place with any
+    keys added to cat_db
+    """
+
+    # the csv if it has been edited, else the table
+    curated = read_db(main_dir, changed_db_name, 'sqlite')
+
+    con = connect(main_dir)
+    con.isolation_level = None
+    con.execute('BEGIN')
+
+    try:
+        replace_rows(con, changed_db_name, curated)
+
+        if changed_db_name == 'unknowns_db':
+            added_keys = sql_after_changed_unknowns(con, curated)
+
+        if changed_db_name == 'fuzzy_db':
+            added_keys = sql_after_changed_fuzzy(con, curated)
+
+        # export before committing, so the tables end up newer
+        for db in CURATION_DBS:
+            export_table(con, db, main_dir)
+
+        con.execute('COMMIT')
+
+    except Exception:
+        con.execute('ROLLBACK')
+        raise
+
+    finally:
+        con.close()
+
+    refresh_arrow_export(main_dir, 'sqlite')
+
+    if gram_index is not None:
+        update_gram_index(gram_index, added_keys=added_keys)
+
+
+def sql_after_changed_unknowns(con, unknowns_db):
+    """
+    As update_after_changed_unknowns(), on the tables.  Returns the
+    _items added to cat_db
+    """
+
+    by_tup = get_db_by_tuple(unknowns_db)
+
+    # rows where accY is NOT unknown
+    changes = by_tup.loc[by_tup['accY'] != 'unknown', 'accY']
+
+    stage_changes(con, changes)
+    overwrite_tx_db_sql(con, 'accY')
+    overwrite_tx_db_sql(con, 'mode', 'overwritten unknown')
+    append_to_db_sql(con, 'cat_db')
+    delete_from_db_sql(con, 'unknowns_db')
+
+    return list(changes.index.get_level_values('_item'))
+
+
+def sql_after_changed_fuzzy(con, fuzzy_db):
+    """
+    As update_after_changed_fuzzy(), on the tables.  Returns the _items
+    added to cat_db
+    """
+
+    by_tup = get_db_by_tuple(fuzzy_db)
+    status = by_tup['status']
+
+    # rejected: unknown in tx_db, and moved to unknowns_db
+    changes = pd.Series('unknown', index=by_tup.index[status == 'rejected'])
+
+    stage_changes(con, changes)
+    overwrite_tx_db_sql(con, 'accY')
+    overwrite_tx_db_sql(con, 'mode', 'rejected fuzzy')
+    append_to_db_sql(con, 'unknowns_db')
+    delete_from_db_sql(con, 'fuzzy_db')
+
+    # each step deletes its rows from fuzzy_db before the next
+    by_tup = by_tup[~by_tup.index.isin(changes.index)]
+    status = by_tup['status']
+
+    # confirmed: the fuzzy accY moved to cat_db
+    confirmed = by_tup.loc[status == 'confirmed', 'accY']
+
+    stage_changes(con, confirmed)
+    append_to_db_sql(con, 'cat_db')
+    delete_from_db_sql(con, 'fuzzy_db')
+    overwrite_tx_db_sql(con, 'mode', 'confirmed fuzzy')
+
+    by_tup = by_tup[~by_tup.index.isin(confirmed.index)]
+    status = by_tup['status']
+
+    # anything else: status is the new accY, for tx_db and cat_db
+    overwritten = status[status.notnull()
+                         & ~status.isin(['rejected', 'confirmed'])]
+
+    stage_changes(con, overwritten)
+    overwrite_tx_db_sql(con, 'accY')
+    overwrite_tx_db_sql(con, 'mode', 'overwritten fuzzy')
+    append_to_db_sql(con, 'cat_db')
+    delete_from_db_sql(con, 'fuzzy_db')
+
+    return (list(confirmed.index.get_level_values('_item'))
+            + list(overwritten.index.get_level_values('_item')))
+
+
+def stage_changes(con, changes):
+    """
+    Fills the temporary changes table from a series of new values indexed
+    by (_item, accX) tuples.  Where a tuple is repeated, the last value is
+    kept.
+    """
+
+    con.execute('DROP TABLE IF EXISTS temp.changes')
+    con.execute('CREATE TEMP TABLE changes '
+                '(_item TEXT, accX TEXT, val, PRIMARY KEY (_item, accX))')
+
+    rows = zip(changes.index.get_level_values(0).tolist(),
+               changes.index.get_level_values(1).tolist(),
+               changes.tolist())
+
+    con.executemany('INSERT OR REPLACE INTO changes VALUES (?, ?, ?)', rows)
+
+
+# rows of a table with an (_item, accX) in the changes table
+IN_CHANGES = ('EXISTS (SELECT 1 FROM changes c WHERE c._item = {db}._item '
+              'AND c.accX = {db}.accX)')
+
+
+def overwrite_tx_db_sql(con, col_to_change='accY', new_val=None,
+                        overwrite_manual=False):
+    """
+    As overwrite_tx_db(), for the staged changes: sets col_to_change to
+    their values - or to new_val if passed
+    """
+
+    if new_val is None:
+        value = ('(SELECT val FROM changes c WHERE c._item = tx_db._item '
+                 'AND c.accX = tx_db.accX)')
+        params = ()
+    else:
+        value = '?'
+        params = (new_val,)
+
+    sql = (f'UPDATE tx_db SET "{col_to_change}" = {value} '
+           f'WHERE {IN_CHANGES.format(db="tx_db")}')
+
+    if not overwrite_manual:
+        sql += " AND mode IS NOT 'manual'"
+
+    con.execute(sql, params)
+
+
+def append_to_db_sql(con, db, column='accY'):
+    """
+    As append_to_db(), adding a row to db for each staged change, with
+    its value in column
+    """
+
+    con.execute(f'INSERT INTO {db} (_item, accX, "{column}") '
+                'SELECT _item, accX, val FROM changes ORDER BY rowid')
+
+
+def delete_from_db_sql(con, db):
+    """
+    As delete_from_db(), deleting the rows of db with staged changes
+    """
+
+    con.execute(f'DELETE FROM {db} WHERE {IN_CHANGES.format(db=db)}')
+
+
+def replace_rows(con, db, df):
+    """
+    Replaces the rows of the table for db with those of df (which is
+    indexed by _item)
+    """
+
+    df = df.reset_index()
+    rows = df.astype(object).where(df.notnull(), None).values.tolist()
+
+    cols = ', '.join(f'"{x}"' for x in df.columns)
+    params = ', '.join('?' * len(df.columns))
+
+    con.execute(f'DELETE FROM {db}')
+    con.executemany(f'INSERT INTO {db} ({cols}) VALUES ({params})', rows)
+
+
+def export_table(con, db, dir_path):
+    """
+    Writes the table for db out to its csv in dir_path
+    """
+
+    cursor = con.execute(f'SELECT * FROM {db}')
+    df = pd.DataFrame(cursor.fetchall(),
+                      columns=[x[0] for x in cursor.description])
+
+    df = apply_schema(df.set_index(INDEX_COLS[db]), db)
+    write_file(df, Path(dir_path) / (db + '.csv'), 'csv')
@@ -1,6 +1,8 @@
 # myfin/finance/update_dbs/update_after_changed_fuzzy.py
 
-import pandas as pd
+import numpy as np
+
+from finance.load_new_txs.gram_index import update_gram_index
 
 from .get_tuples_to_change import get_tuples_to_change
 from .get_db_by_tuple import get_db_by_tuple
@@ -9,12 +11,15 @@ from .overwrite_tx_db import overwrite_tx_db
 from .append_to_db import append_to_db
 from .delete_from_db import delete_from_db
 
-def update_after_changed_fuzzy(dbs):
+def update_after_changed_fuzzy(dbs, gram_index=None):
     """
     Implements changes to fuzzy_db, applying them to other dbs as appropriate.
 
     Returns an updated dict of dbs
 
+    If a gram_index of cat_db is passed, it is updated in place with any
+    keys added to cat_db
+
       - rows to exit:
         - any with status == 'rejected'
           - for these rows, also:
@@ -69,6 +74,9 @@ def update_after_changed_fuzzy(dbs):
     new_vals = get_db_by_tuple(dbs['fuzzy_db']).loc[tuples_to_change, 'accY']
     dbs['cat_db'] = append_to_db(dbs['cat_db'], tuples_to_change, new_vals)
 
+    if gram_index is not None:
+        update_gram_index(gram_index, added_keys=[x[0] for x in tuples_to_change])
+
     # delete from dbs['fuzzy_db'] and reset index for writing out
     dbs['fuzzy_db'] = delete_from_db(dbs['fuzzy_db'], tuples_to_change)
 
@@ -82,7 +90,7 @@ def update_after_changed_fuzzy(dbs):
     # delete from fuzzy_db
     
     # get the tuples to change
-    def f(x): return x not in ['rejected', 'confirmed', pd.np.nan]
+    def f(x): return x not in ['rejected', 'confirmed', np.nan]
     col = 'status'
     tuples_to_change = get_tuples_to_change(dbs['fuzzy_db'], col, f)
 
@@ -97,6 +105,9 @@ def update_after_changed_fuzzy(dbs):
     # append it to cat_db
     dbs['cat_db'] = append_to_db(dbs['cat_db'], tuples_to_change, new_vals)
 
+    if gram_index is not None:
+        update_gram_index(gram_index, added_keys=[x[0] for x in tuples_to_change])
+
     # delete from fuzzy_db
     dbs['fuzzy_db'] = delete_from_db(dbs['fuzzy_db'], tuples_to_change)
 
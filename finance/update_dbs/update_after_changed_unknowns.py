@@ -1,5 +1,7 @@
 # myfin/finance/update_dbs/update_after_changed_unknowns.py
 
+from finance.load_new_txs.gram_index import update_gram_index
+
 from .get_tuples_to_change import get_tuples_to_change
 from .get_db_by_tuple import get_db_by_tuple
 
@@ -8,12 +10,15 @@ from .append_to_db import append_to_db
 from .delete_from_db import delete_from_db
 
 
-def update_after_changed_unknowns(dbs):
+def update_after_changed_unknowns(dbs, gram_index=None):
     """
     Implements changes to unknowns_db, applying them to other dbs as appropriate.
 
     Returns an updated dict of dbs
 
+    If a gram_index of cat_db is passed, it is updated in place with any
+    keys added to cat_db
+
       - rows to exit:
         - any that have an accY assigned (i.e. not 'unknown')
           - for these rows, also:
@@ -41,6 +46,9 @@ def update_after_changed_unknowns(dbs):
     # append to cat_db and reset index for writing out
     dbs['cat_db'] = append_to_db(dbs['cat_db'], tuples_to_change, new_vals)
 
+    if gram_index is not None:
+        update_gram_index(gram_index, added_keys=[x[0] for x in tuples_to_change])
+
     # delete from unknowns and reset index for writing out
     dbs['unknowns_db'] = delete_from_db(dbs['unknowns_db'], tuples_to_change)
 
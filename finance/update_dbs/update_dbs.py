@@ -6,10 +6,15 @@ import copy
 from mylogger import get_filelog
 
 from finance.load_new_txs.archive_dbs import archive_dbs
+from finance.load_new_txs.gram_index import load_gram_index, save_gram_index
 from finance.helpers.load_dbs_from_disk import load_dbs_from_disk
+from finance.helpers.load_config import load_config
+from finance.helpers.project_lock import project_lock
 
 from .update_after_changed_unknowns import update_after_changed_unknowns
 from .update_after_changed_fuzzy import update_after_changed_fuzzy
+from .write_out_dbs import write_out_dbs as write_dbs_to_disk
+from .sqlite_updates import update_sqlite_after_changes
 
 """Functions for updating databases after manual curation of 
 unknowns.csv and fuzzy.csv
@@ -22,6 +27,27 @@ This may entail implementing and using a 'manual' flag in tx_db['mode']
 def update_dbs_after_changes(changed_db_name, acc_path=None, dbs=None,
                              return_dbs=False, write_out_dbs=True):
     """
+    Calls apply_db_changes() (see there for arguments), holding the
+    project lock if working on the dbs on disk, so that no other process
+    writes them in between
+    """
+
+    if acc_path is not None and dbs is None:
+        main_dir = Path(acc_path).parents[1]
+
+        with project_lock(main_dir, load_config(main_dir)['lock_timeout']):
+            return apply_db_changes(changed_db_name, acc_path=acc_path,
+                                    return_dbs=return_dbs,
+                                    write_out_dbs=write_out_dbs)
+
+    return apply_db_changes(changed_db_name, acc_path=acc_path, dbs=dbs,
+                            return_dbs=return_dbs,
+                            write_out_dbs=write_out_dbs)
+
+
+def apply_db_changes(changed_db_name, acc_path=None, dbs=None,
+                     return_dbs=False, write_out_dbs=True):
+    """
     Calls update function for a changed_db_name
         - either 'fuzzy_db' or 'unknowns_db'
 
@@ -31,9 +57,15 @@ def update_dbs_after_changes(changed_db_name, acc_path=None, dbs=None,
     are made to and from disk (i.e. don't implement both fuzzy_db and
     unknowns_db changes on dbs in memory).
 
+    acc_path is the path of an account in the project (its parents[1]).
+
+    With 'sqlite' storage, changes from disk are made in place in the
+    sqlite store (see sqlite_updates.py), without loading the dbs.
     """
     if acc_path is not None:
-        logger = get_filelog(acc_path.parents[1] / 'log.txt')
+        acc_path = Path(acc_path)
+        main_dir = acc_path.parents[1]
+        logger = get_filelog(main_dir / 'log.txt')
         logger.info('calling update_dbs_after_changes() for ' + acc_path.name)
 
     # protection from overwriting disk when testing
@@ -43,31 +75,65 @@ def update_dbs_after_changes(changed_db_name, acc_path=None, dbs=None,
         write_out_dbs=False
         dbs = copy.deepcopy(dbs)
 
+    # update the sqlite store in place
+    if (dbs is None and acc_path is not None
+          and load_config(main_dir)['storage'] == 'sqlite'):
+        return update_sqlite_store(changed_db_name, main_dir,
+                                   return_dbs=return_dbs)
+
     # load dbs from disk, if not passed already
     if dbs is None:
         if acc_path is not None:
-            acc_path = Path(acc_path)
-            dbs = load_dbs(acc_path)
+            dbs = load_dbs_from_disk(main_dir)
         else:
             print('need either an acc_path or dict of dbs')
             return 1
 
+    # keep any cat_db gram index on disk up to date
+    gram_index = None
+    if write_out_dbs and load_config(main_dir)['gram_index']:
+        gram_index = load_gram_index(main_dir, dbs['cat_db'])
+
     SUM_OF_DB_LENS = sum([len(dbs[x]) for x in dbs])
 
     if changed_db_name == 'unknowns_db':
-        dbs = update_after_changed_unknowns(dbs)
+        dbs = update_after_changed_unknowns(dbs, gram_index=gram_index)
 
     if changed_db_name == 'fuzzy_db':
-        dbs = update_after_changed_fuzzy(dbs)
+        dbs = update_after_changed_fuzzy(dbs, gram_index=gram_index)
 
     assert SUM_OF_DB_LENS == sum([len(dbs[x]) for x in dbs])
 
     if write_out_dbs:
-        write_out_dbs(dbs, acc_path, annotation='updated_' + changed_db_name)
+        write_dbs_to_disk(dbs, main_dir,
+                          annotation='updated_' + changed_db_name)
+
+        if gram_index is not None:
+            save_gram_index(gram_index, main_dir)
 
     if return_dbs:
         return dbs
 
 
+def update_sqlite_store(changed_db_name, main_dir, return_dbs=False):
+    """
+    update_dbs_after_changes() for a project with 'sqlite' storage
+    """
+
+    # keep any cat_db gram index on disk up to date
+    gram_index = None
+    if load_config(main_dir)['gram_index']:
+        cat_db = load_dbs_from_disk(main_dir, 'sqlite', ['cat_db'])['cat_db']
+        gram_index = load_gram_index(main_dir, cat_db)
+
+    update_sqlite_after_changes(changed_db_name, main_dir,
+                                gram_index=gram_index)
 
+    archive_dbs(proj_path=main_dir, annotation='updated_' + changed_db_name,
+                storage='sqlite')
 
+    if gram_index is not None:
+        save_gram_index(gram_index, main_dir)
+
+    if return_dbs:
+        return load_dbs_from_disk(main_dir, 'sqlite')
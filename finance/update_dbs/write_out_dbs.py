@@ -1,7 +1,8 @@
 # myfin/finance/update_dbs/write_out_dbs.py
 
 from pathlib import Path
-from finance.load_new_txs import archive_dbs
+from finance.load_new_txs.archive_dbs import archive_dbs
+from finance.helpers.db_storage import write_dbs
 
 def write_out_dbs(dbs, acc_path, archive=True, annotation=None):
     """
@@ -9,14 +10,15 @@ def write_out_dbs(dbs, acc_path, archive=True, annotation=None):
     files in acc_path.
 
     Optionally archive them with the passed annotation
+
+    Written in the storage format of the project config (see db_storage.py)
     """
 
     acc_path = Path(acc_path)
 
-    for db in dbs:
-        dbs[db].to_csv(acc_path / (db + '.csv'))
+    write_dbs(dbs, acc_path)
 
     if archive:
-        archive_dbs(acc_path=acc_path, annotation=annotation)
+        archive_dbs(proj_path=acc_path, annotation=annotation)
 
 